@@ -1,5 +1,14 @@
 from pathlib import Path
+from typing import Dict, Iterator, List, Literal
+import fnmatch
+import glob
 import hashlib
+import os
+import stat
+import time
+
+from pydantic import BaseModel, ConfigDict, Field
+import tomlkit
 
 from cichecker.messages import (
     CheckResponse, 
@@ -7,6 +16,7 @@ from cichecker.messages import (
     PerformanceData,
     truthiness
 )
+from cichecker.deadline import DeadlineExceeded, checkDeadline, deadlineExpired
 from cichecker.cilogger import logger
 
 # logger.setLevel("DEBUG")
@@ -64,7 +74,8 @@ def integrityTest(
     expected_hash:str
         The expected SHA256 hash for this target
     recurse:bool
-        If the target is a directory and recurse is set to true, will traverse the directory tree to generate hash.  This may not meet the return time requirements of Nagios.
+        If the target is a directory and recurse is set to true, will traverse the directory tree to generate hash.  This may not meet the return time requirements of Nagios,
+        set a deadline (--deadline) to get an UNKNOWN with the number of files done instead.
     generate_only:bool
         If set to True, will not verify a hash, but just return it
     
@@ -84,12 +95,17 @@ def integrityTest(
         if target.is_file():
             file_list.append(target)
         elif target.is_dir():
-            if recurse:
-                file_list = [p for p in target.rglob("*") if p.is_file()]
-                logger.debug(f"Recurse. {len(file_list)} files")
-            else:
-                file_list = [p for p in target.glob("*") if p.is_file()]
-                logger.debug(f"{len(file_list)} files")
+            paths = target.rglob("*") if recurse else target.glob("*")
+            for p in paths:
+                checkDeadline()
+                if p.is_file():
+                    file_list.append(p)
+            logger.debug(f"{len(file_list)} files")
+    except DeadlineExceeded:
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Deadline reached while listing {target}, {len(file_list)} files found so far"
+        response.performance_data.append(PerformanceData(label="filesFound", value=len(file_list), unit_of_measure=""))
+        return response
     except FileNotFoundError:
         response.return_code = NCPAPluginReturnCodes.UNKNOWN
         response.message = f"{target} does not exist"
@@ -100,6 +116,7 @@ def integrityTest(
         return response
     
     # Make the hash
+    files_hashed = 0
     try:
         # SHA1 is chosen for speed and since this is not secure communication
         sha1 = hashlib.sha1()
@@ -107,10 +124,12 @@ def integrityTest(
         for fp in file_list:
             with fp.open('rb') as f:
                 while True:
+                    checkDeadline()
                     data = f.read(BUF_SIZE)
                     if not data:
                         break
                     sha1.update(data)
+            files_hashed += 1
         
         # Success if we get here
         if generate_only:
@@ -126,6 +145,12 @@ def integrityTest(
                 response.return_code = NCPAPluginReturnCodes.CRITICAL
                 response.message = f"SHA1 has mismatch.  {target} has changed"
                 response.performance_data.append(truthiness(False))
+    except DeadlineExceeded:
+        # A partial hash cannot be compared, so all we can report is how far we got
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Deadline reached after hashing {files_hashed} of {len(file_list)} files in {target}"
+        response.performance_data.append(PerformanceData(label="filesHashed", value=files_hashed, unit_of_measure=""))
+        response.performance_data.append(PerformanceData(label="filesTotal", value=len(file_list), unit_of_measure=""))
     except Exception as badnews:
         logger.error("Check failed to run", exc_info=1)
         response.return_code = NCPAPluginReturnCodes.UNKNOWN
@@ -142,3 +167,382 @@ def integrityTest(
                 
         
 
+class FilePolicyRule(BaseModel):
+    """
+    Expected attributes for a set of paths.  Any attribute left as None is not checked.
+
+    Parameters
+    ----------
+    paths:List[str]
+        Paths or glob patterns ('*', '?', '[]' and '**') the rule applies to
+    exists:bool
+        If True every path must exist and every glob must match something.  If False none of them may exist.
+    type:str
+        'file', 'dir' or 'symlink'.  Symlinks are not followed.
+    mode:str
+        Exact permission bits as an octal string, for example '0640'
+    owner:str
+        Owning user name or uid (POSIX only)
+    group:str
+        Owning group name or gid (POSIX only)
+    min_size:int
+        Minimum size in bytes
+    max_size:int
+        Maximum size in bytes
+    max_age:float
+        Maximum seconds since last modification
+    """
+    # A misspelt attribute would otherwise be ignored and silently pass, so unknown keys are an error
+    model_config = ConfigDict(extra="forbid")
+
+    paths:List[str] = Field(description="Paths or glob patterns this rule applies to")
+    exists:bool = Field(description="Whether the paths must exist (True) or must not exist (False)", default=True)
+    type:Literal["file", "dir", "symlink"] = Field(description="Expected type of each path", default=None)
+    mode:str = Field(description="Expected permission bits as an octal string", default=None)
+    owner:str = Field(description="Expected owning user name or uid", default=None)
+    group:str = Field(description="Expected owning group name or gid", default=None)
+    min_size:int = Field(description="Minimum size in bytes", default=None)
+    max_size:int = Field(description="Maximum size in bytes", default=None)
+    max_age:float = Field(description="Maximum seconds since last modification", default=None)
+
+# The kinds of violation reported, each gets its own perfdata count
+POLICY_VIOLATION_KINDS = ["missing", "unexpected", "permission", "type", "mode", "owner", "group", "size", "age"]
+
+def loadFilePolicy(policy_file:Path) -> List[FilePolicyRule]:
+    """
+    Reads policy rules from a TOML file with one [[rule]] table per rule, for example:
+
+        [[rule]]
+        paths = ["/etc/app/*.conf"]
+        type = "file"
+        mode = "0640"
+        owner = "root"
+
+    Returns
+    -------
+    List[FilePolicyRule]
+        The rules in the file
+    """
+    policy = tomlkit.parse(Path(policy_file).read_text(encoding="utf-8")).unwrap()
+    return [FilePolicyRule(**rule) for rule in policy.get("rule", [])]
+
+def lookupId(name:str, kind:str) -> int:
+    """
+    Converts a user or group name (or numeric string) to its uid or gid
+    """
+    if name.isdigit():
+        return int(name)
+    # pwd and grp only exist on POSIX, so only import them when owner or group checks are asked for
+    if kind == "owner":
+        import pwd
+        return pwd.getpwnam(name).pw_uid
+    import grp
+    return grp.getgrnam(name).gr_gid
+
+class StatEntry:
+    """
+    Stands in for an os.DirEntry when the listing has no entry to give: roots like / or C:\\ have no parent to list,
+    and on a case-insensitive volume os.path.normcase does not know about (macOS) the name may differ in case from the listing
+    """
+    def __init__(self, path:str, st:os.stat_result):
+        self.path = path
+        self.name = os.path.basename(path) or path
+        self._stat = st
+
+    def is_file(self, follow_symlinks:bool = True) -> bool:
+        try:
+            return stat.S_ISREG(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_dir(self, follow_symlinks:bool = True) -> bool:
+        try:
+            return stat.S_ISDIR(self.stat(follow_symlinks).st_mode)
+        except OSError:
+            return False
+
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self._stat.st_mode)
+
+    def stat(self, follow_symlinks:bool = True) -> os.stat_result:
+        # Like DirEntry, follow_symlinks needs a stat of its own for a symlink
+        if follow_symlinks and stat.S_ISLNK(self._stat.st_mode):
+            return os.stat(self.path)
+        return self._stat
+
+class DirectoryListing:
+    """
+    Caches a single scandir pass per directory so every path and glob in that directory is answered from one listing.
+    DirEntry objects give existence and type without a stat call, and cache their stat result when one is needed.
+    Listings are keyed by os.path.normcase of each name, so C:\\Windows\\system32 finds System32 on Windows as Path.exists() would.
+    Directories that cannot be listed are remembered in errors so their paths can be reported rather than called missing.
+    """
+    def __init__(self):
+        self.listings:Dict[str, Dict[str, os.DirEntry]] = {}
+        self.errors:Dict[str, OSError] = {}
+
+    def entries(self, directory:str) -> Dict[str, os.DirEntry]:
+        if directory not in self.listings:
+            try:
+                with os.scandir(directory) as it:
+                    self.listings[directory] = {os.path.normcase(entry.name): entry for entry in it}
+            except (FileNotFoundError, NotADirectoryError):
+                self.listings[directory] = {}
+            except OSError as badnews:
+                logger.debug(f"Unable to list {directory} because {badnews}")
+                self.errors[directory] = badnews
+                self.listings[directory] = {}
+        return self.listings[directory]
+
+    def listingError(self, path:str) -> OSError:
+        """
+        Returns the error from listing the directory path is in (or the directory a glob pattern points into), if there was one
+        """
+        return self.errors.get(os.path.dirname(os.path.abspath(path)))
+
+    def lookup(self, path:str) -> os.DirEntry:
+        (directory, name) = os.path.split(os.path.abspath(path))
+        if name == "":
+            # A root has no parent directory to list, so it costs a stat of its own
+            try:
+                return StatEntry(directory, os.lstat(directory))
+            except FileNotFoundError:
+                return None
+        entry = self.entries(directory).get(os.path.normcase(name))
+        if entry is None and directory not in self.errors:
+            # Only names missing from the listing pay for a stat, which settles it on case-insensitive volumes normcase misses
+            try:
+                return StatEntry(os.path.join(directory, name), os.lstat(os.path.join(directory, name)))
+            except OSError:
+                return None
+        return entry
+
+    def match(self, pattern:str, unreadable:List[str] = None) -> Iterator[os.DirEntry]:
+        """
+        Yields the entries matching a glob pattern ('*', '?', '[]' and '**' for any number of directories).
+        The pattern is walked one directory at a time using the cached listings, and the walk stops as soon as the deadline passes.
+        Like glob, wildcards do not match hidden names unless the pattern part starts with a dot, and '**' does not follow symlinks.
+
+        Parameters
+        ----------
+        pattern:str
+            The glob pattern
+        unreadable:List[str]
+            If given, each directory the walk could not list is appended to it
+        """
+        parts = Path(os.path.abspath(pattern)).parts
+        # Start from the deepest directory with no wildcards, there is no need to list the ones above it
+        first_magic = next(i for (i, part) in enumerate(parts) if glob.has_magic(part))
+        # Depth first walk of (directory, index of the pattern part to match in it)
+        to_visit = [(os.path.join(*parts[:first_magic]), first_magic)]
+        visited = set()
+        while len(to_visit) > 0:
+            if deadlineExpired():
+                return
+            (directory, i) = to_visit.pop()
+            if (directory, i) in visited:
+                continue
+            visited.add((directory, i))
+
+            entries = self.entries(directory)
+            if directory in self.errors and unreadable is not None:
+                unreadable.append(directory)
+            part = parts[i]
+            last = i == len(parts) - 1
+            found = []
+            next_visits = []
+
+            if part == "**":
+                if not last:
+                    # '**' can match no directories at all
+                    next_visits.append((directory, i + 1))
+                for (name, entry) in sorted(entries.items()):
+                    if name.startswith("."):
+                        continue
+                    if last:
+                        found.append(entry)
+                    if entry.is_dir(follow_symlinks=False):
+                        next_visits.append((entry.path, i))
+            else:
+                if glob.has_magic(part):
+                    # fnmatch applies normcase to the pattern as well
+                    matches = [entries[n] for n in sorted(entries) if fnmatch.fnmatch(n, part) and (not n.startswith(".") or part.startswith("."))]
+                else:
+                    entry = self.lookup(os.path.join(directory, part))
+                    matches = [entry] if entry is not None else []
+                for entry in matches:
+                    if last:
+                        found.append(entry)
+                    elif entry.is_dir():
+                        next_visits.append((entry.path, i + 1))
+
+            yield from found
+            # Reversed so the walk visits directories in name order
+            to_visit.extend(reversed(next_visits))
+
+def checkFilePolicy(
+        rules:List[FilePolicyRule]
+) -> tuple:
+    """
+    Checks every path in the rules against its expected attributes.
+
+    Parameters
+    ----------
+    rules:List[FilePolicyRule]
+        The rules to check
+
+    Returns
+    -------
+    tuple
+        (number of paths checked, list of (path, violation kind, description) for each violation, True if every path was checked before the deadline)
+    """
+    listing = DirectoryListing()
+    now = time.time()
+    checked = 0
+    violations = []
+
+    for rule in rules:
+        expected_mode = int(rule.mode, 8) if rule.mode is not None else None
+        expected_uid = lookupId(rule.owner, "owner") if rule.owner is not None else None
+        expected_gid = lookupId(rule.group, "group") if rule.group is not None else None
+
+        for pattern in rule.paths:
+            if deadlineExpired():
+                logger.debug(f"Deadline reached after {checked} paths")
+                return (checked, violations, False)
+            unreadable = []
+            if glob.has_magic(pattern):
+                entries = listing.match(pattern, unreadable)
+            else:
+                entry = listing.lookup(pattern)
+                entries = [entry] if entry is not None else []
+                if entry is None and listing.listingError(pattern) is not None:
+                    unreadable.append(os.path.dirname(os.path.abspath(pattern)))
+
+            found = 0
+            for entry in entries:
+                # A recursive glob can cover a whole tree, so check the deadline for every path
+                if deadlineExpired():
+                    logger.debug(f"Deadline reached after {checked} paths")
+                    return (checked, violations, False)
+                found += 1
+                checked += 1
+                if not rule.exists:
+                    violations.append((entry.path, "unexpected", "exists but should not"))
+                    continue
+                try:
+                    violations.extend(checkEntry(entry, rule, expected_mode, expected_uid, expected_gid, now))
+                except FileNotFoundError:
+                    violations.append((entry.path, "missing", "was removed while being checked"))
+                except OSError as badnews:
+                    violations.append((entry.path, "permission", f"cannot be checked because {badnews}"))
+
+            if deadlineExpired():
+                # The glob walk may have stopped early, so no matches does not mean missing
+                logger.debug(f"Deadline reached after {checked} paths")
+                return (checked, violations, False)
+            for directory in unreadable:
+                checked += 1
+                violations.append((directory, "permission", f"cannot be listed to check {pattern} because {listing.errors[directory]}"))
+            if found == 0 and len(unreadable) == 0:
+                checked += 1
+                if rule.exists:
+                    violations.append((pattern, "missing", "no paths match" if glob.has_magic(pattern) else "does not exist"))
+
+    logger.debug(f"{checked} paths checked from {len(listing.listings)} directory listings")
+    return (checked, violations, True)
+
+def checkEntry(
+        entry:os.DirEntry,
+        rule:FilePolicyRule,
+        expected_mode:int,
+        expected_uid:int,
+        expected_gid:int,
+        now:float
+) -> list:
+    """
+    Checks one existing path against a rule's attributes
+
+    Returns
+    -------
+    list
+        (path, violation kind, description) for each violation
+    """
+    violations = []
+    if rule.type is not None:
+        match rule.type:
+            case "file":
+                type_ok = entry.is_file(follow_symlinks=False)
+            case "dir":
+                type_ok = entry.is_dir(follow_symlinks=False)
+            case "symlink":
+                type_ok = entry.is_symlink()
+        if not type_ok:
+            violations.append((entry.path, "type", f"is not a {rule.type}"))
+
+    needs_stat = [expected_mode, expected_uid, expected_gid, rule.min_size, rule.max_size, rule.max_age]
+    if all(n is None for n in needs_stat):
+        return violations
+    st = entry.stat(follow_symlinks=False)
+
+    if expected_mode is not None and stat.S_IMODE(st.st_mode) != expected_mode:
+        violations.append((entry.path, "mode", f"mode is {stat.S_IMODE(st.st_mode):04o}, expected {expected_mode:04o}"))
+    if expected_uid is not None and st.st_uid != expected_uid:
+        violations.append((entry.path, "owner", f"owner uid is {st.st_uid}, expected {rule.owner}"))
+    if expected_gid is not None and st.st_gid != expected_gid:
+        violations.append((entry.path, "group", f"group gid is {st.st_gid}, expected {rule.group}"))
+    if rule.min_size is not None and st.st_size < rule.min_size:
+        violations.append((entry.path, "size", f"size {st.st_size} is below {rule.min_size} bytes"))
+    if rule.max_size is not None and st.st_size > rule.max_size:
+        violations.append((entry.path, "size", f"size {st.st_size} is above {rule.max_size} bytes"))
+    if rule.max_age is not None and now - st.st_mtime > rule.max_age:
+        violations.append((entry.path, "age", f"last modified {int(now - st.st_mtime)}s ago, limit is {int(rule.max_age)}s"))
+    return violations
+
+def policyTest(
+    policy:Path
+) -> CheckResponse:
+    """
+    Checks many paths against expected attributes (existence, type, mode, owner, group, size, age) in one go.
+    Each directory involved is listed once, however many paths or globs point into it.
+
+    Parameters
+    ----------
+    policy:Path
+        A TOML policy file (see loadFilePolicy) or a list of FilePolicyRule objects
+
+    Returns
+    -------
+    CheckResponse
+        A check response object.  verbose lists each violation.
+    """
+    response = CheckResponse(name="File policy test")
+    try:
+        rules = policy if isinstance(policy, list) else loadFilePolicy(policy)
+        (checked, violations, complete) = checkFilePolicy(rules)
+
+        if not complete:
+            # Violations already found still count, otherwise we cannot say the policy holds
+            response.return_code = NCPAPluginReturnCodes.CRITICAL if len(violations) > 0 else NCPAPluginReturnCodes.UNKNOWN
+            response.message = f"Deadline reached after checking {checked} paths, {len(violations)} policy violations so far"
+            response.verbose = "\n".join(f"{kind}: {path} {description}" for (path, kind, description) in violations) or None
+        elif len(violations) == 0:
+            response.return_code = NCPAPluginReturnCodes.OK
+            response.message = f"All {checked} paths match the policy"
+        else:
+            response.return_code = NCPAPluginReturnCodes.CRITICAL
+            response.message = f"{len(violations)} policy violations in {checked} paths checked"
+            response.verbose = "\n".join(f"{kind}: {path} {description}" for (path, kind, description) in violations)
+
+        response.performance_data.append(truthiness(len(violations) == 0 and complete))
+        response.performance_data.append(PerformanceData(label="pathsChecked", value=checked, unit_of_measure=""))
+        response.performance_data.append(PerformanceData(label="violations", value=len(violations), unit_of_measure=""))
+        for kind in POLICY_VIOLATION_KINDS:
+            count = len([v for v in violations if v[1] == kind])
+            response.performance_data.append(PerformanceData(label=kind, value=count, unit_of_measure=""))
+    except Exception as badnews:
+        logger.error("Check failed to run", exc_info=1)
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Unable to check file policy because {badnews}"
+
+    return response
@@ -0,0 +1,258 @@
+import time
+from typing import List
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import DecodeError, ProtocolError, ReadTimeoutError, SSLError
+
+from cichecker.messages import (
+    CheckResponse,
+    NCPAPluginReturnCodes,
+    PerformanceData,
+    truthiness,
+    worstReturnCode
+)
+from cichecker.deadline import DeadlineExceeded, capTimeout, checkDeadline
+from cichecker.cilogger import logger
+
+# logger.setLevel("DEBUG")
+
+# One session is shared by every HTTP check in this process so connections to the same host are kept alive and reused
+_session = None
+
+def getSession(pool_size:int = 10) -> requests.Session:
+    """
+    Returns the shared requests Session, creating it on first use.
+
+    Parameters
+    ----------
+    pool_size:int
+        Number of keep-alive connections to hold open per host.  Only used when the session is first created.
+
+    Returns
+    -------
+    requests.Session
+        The shared session
+    """
+    global _session
+    if _session is None:
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _session.mount("http://", adapter)
+        _session.mount("https://", adapter)
+    return _session
+
+def readChunks(r:requests.Response, chunk_size:int = 65536):
+    """
+    Yields the response body as the data arrives.
+
+    iter_content waits until it has a full chunk, so a slow server can hold each read open for a long time.
+    read1 returns whatever has arrived instead, so the caller gets control back after every packet.
+    Falls back to small iter_content chunks where urllib3 does not have read1.
+    urllib3 errors are raised as the requests exceptions iter_content would raise, so callers only handle one set.
+    """
+    if hasattr(r.raw, "read1"):
+        while True:
+            try:
+                chunk = r.raw.read1(chunk_size, decode_content=True)
+            except ReadTimeoutError as badnews:
+                raise requests.ReadTimeout(badnews, response=r) from badnews
+            except SSLError as badnews:
+                raise requests.exceptions.SSLError(badnews, response=r) from badnews
+            except ProtocolError as badnews:
+                # For example the server closed the connection before sending the whole body
+                raise requests.ConnectionError(badnews, response=r) from badnews
+            except DecodeError as badnews:
+                raise requests.exceptions.ContentDecodingError(badnews, response=r) from badnews
+            if not chunk:
+                return
+            yield chunk
+    else:
+        yield from r.iter_content(chunk_size=1024)
+
+def probeURL(
+        url:str,
+        expected_status:int = 200,
+        expected_content:str = None,
+        etag:str = None,
+        if_modified_since:str = None,
+        timeout:float = 5.0,
+        verify_tls:bool = True
+) -> tuple:
+    """
+    Makes a single GET request against url and evaluates it.  The body is only downloaded if it is needed.
+
+    Parameters
+    ----------
+    url:str
+        The URL to request
+    expected_status:int
+        The HTTP status code the endpoint should return
+    expected_content:str
+        If set, this string must appear in the response body
+    etag:str
+        If set, sent as If-None-Match.  A 304 response means the resource has not changed.
+    if_modified_since:str
+        If set, sent as If-Modified-Since (HTTP date format).  A 304 response means the resource has not changed.
+    timeout:float
+        How long in seconds to wait for the server to connect and to send each chunk of data
+    verify_tls:bool
+        Set to False to skip certificate verification for https URLs
+
+    Returns
+    -------
+    tuple
+        (NCPAPluginReturnCodes, message, ttfb in ms, total time in ms)
+    """
+    headers = {}
+    conditional = etag is not None or if_modified_since is not None
+    if etag is not None:
+        headers["If-None-Match"] = etag
+    if if_modified_since is not None:
+        headers["If-Modified-Since"] = if_modified_since
+
+    start = time.perf_counter()
+    # stream=True returns as soon as the headers arrive, which gives us time to first byte
+    with getSession().get(url, headers=headers, timeout=timeout, verify=verify_tls, stream=True) as r:
+        ttfb = time.perf_counter() - start
+        if conditional and r.status_code == 304:
+            total = time.perf_counter() - start
+            return (NCPAPluginReturnCodes.OK, f"{url} has not changed", ttfb*1000, total*1000)
+
+        # Always read the whole body so the connection can be reused, but only keep it when we have to check it.
+        # The timeout only limits each socket read, so a server trickling the body could outlast the deadline
+        # unless we check it between chunks.
+        chunks = []
+        for chunk in readChunks(r):
+            checkDeadline()
+            if expected_content is not None:
+                chunks.append(chunk)
+        body = None
+        if expected_content is not None:
+            body = b"".join(chunks).decode(r.encoding or "utf-8", errors="replace")
+        total = time.perf_counter() - start
+
+        if conditional and r.status_code == 200:
+            validators = []
+            if r.headers.get("ETag") is not None:
+                validators.append(f"ETag is now {r.headers['ETag']}")
+            if r.headers.get("Last-Modified") is not None:
+                validators.append(f"Last-Modified is now {r.headers['Last-Modified']}")
+            message = f"{url} has changed"
+            if len(validators) > 0:
+                message += f" ({', '.join(validators)})"
+            return (NCPAPluginReturnCodes.CRITICAL, message, ttfb*1000, total*1000)
+
+        if r.status_code != expected_status:
+            return (NCPAPluginReturnCodes.CRITICAL, f"{url} returned status {r.status_code}, expected {expected_status}", ttfb*1000, total*1000)
+
+        if body is not None and expected_content not in body:
+            return (NCPAPluginReturnCodes.CRITICAL, f"{url} response did not contain the expected content", ttfb*1000, total*1000)
+
+        return (NCPAPluginReturnCodes.OK, f"{url} returned status {r.status_code}", ttfb*1000, total*1000)
+
+def httpTest(
+        urls:List[str],
+        expected_status:int = 200,
+        expected_content:str = None,
+        etag:str = None,
+        if_modified_since:str = None,
+        timeout:float = 5.0,
+        verify_tls:bool = True
+) -> CheckResponse:
+    """
+    This check will verify one or more HTTP(S) endpoints respond as expected.
+    All URLs share one keep-alive connection pool, so probing many URLs on the same host only pays for the connection once.
+
+    Set etag and/or if_modified_since to make a conditional request.  In that case a 304 (not modified) is OK, and a 200 means
+    the resource has changed and is CRITICAL.  The new ETag and Last-Modified values are included in the message to use as the next baseline.
+
+    Parameters
+    ----------
+    urls:List[str]
+        URL or list of URLs to request
+    expected_status:int
+        The HTTP status code the endpoints should return.  Ignored for conditional requests.
+    expected_content:str
+        If set, this string must appear in each response body
+    etag:str
+        The expected ETag, sent as If-None-Match
+    if_modified_since:str
+        HTTP date sent as If-Modified-Since
+    timeout:float
+        How long in seconds the request will wait before erroring out.  If you make it too long you may hang you Nagios checks.
+        If the deadline (--deadline) comes first the check stops and reports the URLs it finished.
+    verify_tls:bool
+        Set to False to skip certificate verification for https URLs
+
+    Returns
+    -------
+    CheckResponse
+        A check response object
+    """
+    response = CheckResponse(name="httpTest")
+    if isinstance(urls, str):
+        urls = [urls]
+
+    codes = []
+    messages = []
+    complete = True
+    for url in urls:
+        # Perfdata labels need to be unique when more than one URL is checked
+        label_prefix = "" if len(urls) == 1 else f"{url} "
+        request_timeout = capTimeout(float(timeout))
+        try:
+            checkDeadline()
+            (code, message, ttfb, total) = probeURL(
+                url,
+                expected_status=expected_status,
+                expected_content=expected_content,
+                etag=etag,
+                if_modified_since=if_modified_since,
+                timeout=request_timeout,
+                verify_tls=verify_tls
+            )
+            response.performance_data.append(
+                PerformanceData(label=f"{label_prefix}ttfb", value=round(ttfb, 1), unit_of_measure="ms")
+            )
+            response.performance_data.append(
+                PerformanceData(label=f"{label_prefix}totalTime", value=round(total, 1), unit_of_measure="ms")
+            )
+        except DeadlineExceeded:
+            complete = False
+            break
+        except requests.Timeout as badnews:
+            if request_timeout < float(timeout):
+                # Only timed out because the deadline shortened the wait, so we do not know the answer
+                complete = False
+                break
+            code = NCPAPluginReturnCodes.CRITICAL
+            message = f"Not able to reach {url} because {badnews}"
+        except requests.ConnectionError as badnews:
+            code = NCPAPluginReturnCodes.CRITICAL
+            message = f"Not able to reach {url} because {badnews}"
+        except Exception as badnews:
+            logger.error("Check failed to run", exc_info=1)
+            code = NCPAPluginReturnCodes.UNKNOWN
+            message = f"Unable to check {url} because {badnews}"
+        codes.append(code)
+        messages.append(message)
+
+    if not complete:
+        # Problems already found still count, otherwise we cannot say everything is fine
+        response.return_code = worstReturnCode(codes + [NCPAPluginReturnCodes.UNKNOWN])
+        response.message = f"Deadline reached after probing {len(codes)} of {len(urls)} URLs"
+        response.verbose = "\n".join(messages) or None
+        response.performance_data.append(PerformanceData(label="endpointsProbed", value=len(codes), unit_of_measure=""))
+        return response
+
+    response.return_code = worstReturnCode(codes)
+    if len(urls) == 1:
+        response.message = messages[0]
+    else:
+        failed = len([c for c in codes if c != NCPAPluginReturnCodes.OK])
+        response.message = f"{len(urls) - failed} of {len(urls)} URLs OK"
+        response.verbose = "\n".join(messages)
+    response.performance_data.append(truthiness(response.return_code == NCPAPluginReturnCodes.OK))
+
+    return response
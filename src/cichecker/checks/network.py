@@ -1,20 +1,185 @@
+import errno
+import os
+import select
 import socket
+import struct
 import time
+from pathlib import Path
+from typing import List
 
 from cichecker.messages import (
     CheckResponse, 
     NCPAPluginReturnCodes,
     PerformanceData,
-    truthiness
+    truthiness,
+    worstReturnCode
 )
+from cichecker.perfhistory import checkAgainstHistory
+from cichecker.deadline import DeadlineExceeded, capTimeout, checkDeadline, deadlineExpired
 from cichecker.cilogger import logger
 
+class HostUnreachableError(ConnectionError):
+    pass
+
+# Windows sockets report WSA error codes rather than the POSIX ones.  The numbers are fixed by Winsock,
+# and only the Windows errno module names them, so fall back to the raw values elsewhere.
+WSAEWOULDBLOCK = getattr(errno, "WSAEWOULDBLOCK", 10035)
+WSAEINPROGRESS = getattr(errno, "WSAEINPROGRESS", 10036)
+WSAENETUNREACH = getattr(errno, "WSAENETUNREACH", 10051)
+WSAECONNREFUSED = getattr(errno, "WSAECONNREFUSED", 10061)
+WSAEHOSTUNREACH = getattr(errno, "WSAEHOSTUNREACH", 10065)
+
+# connect() errors that are a definitive answer, so there is no point waiting for the timeout
+REFUSED_ERRNOS = {errno.ECONNREFUSED, WSAECONNREFUSED}
+UNREACHABLE_ERRNOS = {errno.EHOSTUNREACH, errno.ENETUNREACH, WSAEHOSTUNREACH, WSAENETUNREACH}
+IN_PROGRESS_ERRNOS = {errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN, WSAEWOULDBLOCK, WSAEINPROGRESS}
+
+def interleaveAddresses(addresses:list) -> list:
+    """
+    Orders getaddrinfo results per RFC 8305 section 4: alternate address families, starting with the family of the first (preferred) address
+    """
+    if len(addresses) == 0:
+        return []
+    first_family = addresses[0][0]
+    preferred = [a for a in addresses if a[0] == first_family]
+    others = [a for a in addresses if a[0] != first_family]
+    ordered = []
+    for i in range(max(len(preferred), len(others))):
+        ordered.extend(preferred[i:i+1])
+        ordered.extend(others[i:i+1])
+    return ordered
+
+def happyEyeballsConnect(
+        dest_host:str,
+        dest_port:int,
+        sock_type:int = socket.SOCK_STREAM,
+        timeout:float = 5.0,
+        attempt_delay:float = 0.25
+) -> tuple:
+    """
+    Connects to a host over IPv6 or IPv4, racing the resolved addresses as in RFC 8305 (happy eyeballs).
+    A new attempt starts every attempt_delay seconds, or straight away when an attempt fails.  The first attempt to connect wins.
+    Returns as soon as every attempt has definitively failed (connection refused, host unreachable) instead of waiting for the timeout.
+    Addresses this host cannot open a socket for, such as IPv6 ones when IPv6 is disabled, are skipped.
+
+    Parameters
+    ----------
+    dest_host:str
+        Host or IP to connect to
+    dest_port:int
+        Port to connect to
+    sock_type:int
+        socket.SOCK_STREAM or socket.SOCK_DGRAM
+    timeout:float
+        How long in seconds resolving the name and all the attempts together may take
+    attempt_delay:float
+        Seconds to wait on one attempt before starting the next
+
+    Returns
+    -------
+    tuple
+        (connected socket, address family that won)
+
+    Raises
+    ------
+    TimeoutError
+        No attempt succeeded or failed in time
+    ConnectionRefusedError
+        At least one address actively refused the connection and no other succeeded
+    HostUnreachableError
+        Every address was unreachable
+    """
+    # The timeout covers resolving the name too, so a slow lookup cannot push the attempts past it
+    deadline = time.perf_counter() + timeout
+    addresses = interleaveAddresses(socket.getaddrinfo(dest_host, dest_port, socket.AF_UNSPEC, sock_type))
+    # socket -> address family for attempts still in progress
+    pending = {}
+    # errno of each attempt the far end answered, and of each attempt we could not even start locally
+    errors = []
+    local_errors = []
+    next_index = 0
+    next_attempt_at = time.perf_counter()
+
+    def finish(winner):
+        family = pending.pop(winner)
+        winner.setblocking(True)
+        return (winner, family)
+
+    try:
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                raise TimeoutError(f"Timed out connecting to {dest_host} port {dest_port}")
+
+            if next_index < len(addresses) and (now >= next_attempt_at or len(pending) == 0):
+                (family, type_, proto, _, sockaddr) = addresses[next_index]
+                next_index += 1
+                next_attempt_at = now + attempt_delay
+                try:
+                    sock = socket.socket(family, type_, proto)
+                except OSError as badnews:
+                    # For example EAFNOSUPPORT when IPv6 is disabled but the name still resolves to an IPv6 address
+                    logger.debug(f"Unable to open a socket for {sockaddr} because {badnews}")
+                    local_errors.append(badnews.errno if badnews.errno is not None else errno.EINVAL)
+                    next_attempt_at = now
+                    continue
+                pending[sock] = family
+                sock.setblocking(False)
+                try:
+                    result = sock.connect_ex(sockaddr)
+                except OSError as badnews:
+                    result = badnews.errno if badnews.errno is not None else errno.EINVAL
+                if result == 0:
+                    return finish(sock)
+                if result not in IN_PROGRESS_ERRNOS:
+                    logger.debug(f"Connection to {sockaddr} failed straight away: {os.strerror(result)}")
+                    errors.append(result)
+                    del pending[sock]
+                    sock.close()
+                    next_attempt_at = now
+                continue
+
+            if len(pending) == 0:
+                # Every address has been tried and failed
+                break
+
+            wait = deadline - now
+            if next_index < len(addresses):
+                wait = min(wait, next_attempt_at - now)
+            # Windows reports failed connects in the exceptional set rather than as writable
+            (_, writable, exceptional) = select.select([], list(pending), list(pending), max(0.0, wait))
+            for sock in set(writable) | set(exceptional):
+                result = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if result == 0:
+                    return finish(sock)
+                logger.debug(f"Connection attempt failed: {os.strerror(result)}")
+                errors.append(result)
+                del pending[sock]
+                sock.close()
+                # A failed attempt means the next one can start now
+                next_attempt_at = time.perf_counter()
+    finally:
+        # Close every attempt that did not win, however we got here
+        for s in pending:
+            s.close()
+
+    if any(e in REFUSED_ERRNOS for e in errors):
+        raise ConnectionRefusedError(errno.ECONNREFUSED, os.strerror(errno.ECONNREFUSED))
+    if len(errors) > 0 and all(e in UNREACHABLE_ERRNOS for e in errors):
+        raise HostUnreachableError(errors[-1], os.strerror(errors[-1]))
+    if len(errors) > 0 or len(local_errors) > 0:
+        last_error = errors[-1] if len(errors) > 0 else local_errors[-1]
+        raise OSError(last_error, os.strerror(last_error))
+    raise OSError(f"No addresses found for {dest_host}")
+
 def connectTest(
         dest_host:str, 
         dest_port:int, 
         protocol:str = "TCP",
         timeout:float = 5.0,
-        check_block_instead = False
+        check_block_instead = False,
+        history_dir:Path = None,
+        warn_factor:float = 3.0
 ) -> CheckResponse:
     """
     This check will verify a host can access another host and port
@@ -28,9 +193,14 @@ def connectTest(
     protocol:int
         'TCP' or 'UDP'
     timeout:float
-        How long in seconds the attempted connection will wait before erroring out.  If you make it too long you may hang you Nagios checks
+        How long in seconds the attempted connection will wait before erroring out.  If you make it too long you may hang you Nagios checks.
+        Refused and unreachable connections return straight away.  Shortened if needed to end by the deadline (--deadline), in which case the check is UNKNOWN.
     check_block_instead:bool
         This reverses the results.  A successful block will indicate a response of OK.  This is mainly used to ensure segregation rules are working.
+    history_dir:Path
+        If set, connect times are kept in a rolling history here and the check will WARN when a connect time is more than warn_factor times the rolling p95
+    warn_factor:float
+        How many times the rolling p95 connect time is allowed before a WARNING.  Only used with history_dir
 
     Returns
     -------
@@ -52,29 +222,65 @@ def connectTest(
         dest_port = int(dest_port)
         timeout = float(timeout)
 
-        # attempt connection
+        # attempt connection over IPv6 and IPv4, giving up at the deadline if that comes first
+        checkDeadline()
+        connect_timeout = capTimeout(timeout)
         start = time.time()
-        sock = socket.socket(socket.AF_INET, protocol_raw)
-        sock.settimeout(timeout)
-        result = sock.connect((dest_host, dest_port))
+        try:
+            (sock, family) = happyEyeballsConnect(dest_host, dest_port, protocol_raw, connect_timeout)
+        except TimeoutError:
+            if connect_timeout < timeout:
+                raise DeadlineExceeded() from None
+            raise
         end = time.time()
+        sock.close()
+        ip_version = 6 if family == socket.AF_INET6 else 4
         
         # if we get here, the connection was made
         if not check_block_instead:
             response.return_code = NCPAPluginReturnCodes.OK
-            response.message = f"Able to connect to {dest_host} port {dest_port} via {protocol}"
+            response.message = f"Able to connect to {dest_host} port {dest_port} via {protocol} over IPv{ip_version}"
+            connect_time = PerformanceData(
+                label="connectTime",
+                value=round((end-start)*1000, 1),
+                unit_of_measure="ms"                              
+            )
+            response.performance_data.append(connect_time)
             response.performance_data.append(
                 PerformanceData(
-                    label="connectTime",
-                    value=round((end-start)*1000, 1),
-                    unit_of_measure="ms"                              
+                    label="ipVersion",
+                    value=ip_version,
+                    unit_of_measure=""
                 )
             )
+            if history_dir is not None:
+                try:
+                    (history_perf, exceeded) = checkAgainstHistory(
+                        connect_time,
+                        f"connectTest_{dest_host}_{dest_port}_{protocol}",
+                        history_dir,
+                        warn_factor=warn_factor,
+                        sample=(end-start)*1000
+                    )
+                except Exception as badnews:
+                    # The connection worked, so a history problem should not turn the check UNKNOWN
+                    logger.warning(f"Unable to compare with connect time history because {badnews}")
+                    (history_perf, exceeded) = ([], False)
+                response.performance_data.extend(history_perf)
+                if exceeded:
+                    response.return_code = NCPAPluginReturnCodes.WARNING
+                    response.message += f" but connect time {connect_time.value}ms is above {connect_time.warn_threshold}ms ({warn_factor}x rolling p95)"
         else:
             response.return_code = NCPAPluginReturnCodes.CRITICAL
-            response.message = f"Was able to connect to {dest_host} port {dest_port} via {protocol} but this connection should be blocked"
+            response.message = f"Was able to connect to {dest_host} port {dest_port} via {protocol} over IPv{ip_version} but this connection should be blocked"
             response.performance_data.append(truthiness(False))
 
+    except DeadlineExceeded:
+        # Not waiting the full timeout means we cannot tell if the connection would have been made
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Deadline reached before the connection to {dest_host} port {dest_port} via {protocol} completed"
+        response.performance_data.append(PerformanceData(label="endpointsProbed", value=0, unit_of_measure=""))
+
     except TimeoutError:
         # Per documentation this should be a closed port
         if not check_block_instead:
@@ -96,6 +302,16 @@ def connectTest(
             response.message = f"Connection {dest_host} port {dest_port} via {protocol} blocked as planned" 
             response.performance_data.append(truthiness(True))
 
+    except HostUnreachableError:
+        if not check_block_instead:
+            response.return_code = NCPAPluginReturnCodes.CRITICAL
+            response.message = f"Not able to connect to {dest_host} port {dest_port} via {protocol}, host unreachable"
+            response.performance_data.append(truthiness(False))
+        else:
+            response.return_code = NCPAPluginReturnCodes.OK
+            response.message = f"Connection {dest_host} port {dest_port} via {protocol} blocked as planned"
+            response.performance_data.append(truthiness(True))
+
     except Exception as badnews:
         logger.error("Check failed to run", exc_info=1)
         response.return_code = NCPAPluginReturnCodes.UNKNOWN
@@ -130,20 +346,264 @@ def blockTest(
     """
     return connectTest(dest_host, dest_port, protocol, timeout, check_block_instead=True)
 
-import platform    # For getting the operating system name
-import subprocess  # For executing a shell command
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+def icmpChecksum(data:bytes) -> int:
+    """
+    Internet checksum (RFC 1071) of data
+    """
+    if len(data) % 2:
+        data += b"\x00"
+    total = sum(struct.unpack(f"!{len(data)//2}H", data))
+    total = (total >> 16) + (total & 0xFFFF)
+    total += total >> 16
+    return ~total & 0xFFFF
+
+def openICMPSocket() -> tuple:
+    """
+    Opens an ICMP socket for sending echo requests.
+    Tries an unprivileged datagram socket first (Linux with net.ipv4.ping_group_range set, macOS), then a raw socket (needs root or Administrator).
+
+    Returns
+    -------
+    tuple
+        (socket, True if it is a raw socket)
+    """
+    try:
+        return (socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP), False)
+    except OSError:
+        logger.debug("Unprivileged ICMP socket not allowed, trying a raw socket")
+    return (socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP), True)
+
+def pingHosts(
+        hosts:List[str],
+        count:int = 3,
+        timeout:float = 1.0,
+        interval:float = 0.2
+) -> dict:
+    """
+    Sends ICMP echo requests to every host over a single socket and collects the replies.
+    Rounds of requests go out interval seconds apart, and each host gets count requests.
+
+    Parameters
+    ----------
+    hosts:List[str]
+        Hosts or IPv4 addresses to ping
+    count:int
+        Number of echo requests to send to each host
+    timeout:float
+        How long in seconds to wait for replies after the last request is sent
+    interval:float
+        Seconds between rounds of requests
+
+    Returns
+    -------
+    tuple
+        (results, complete).  results maps each host to a dict of 'sent' (int), 'rtts' (list of round trip times in ms)
+        and 'pending' (int) or 'error' (str) if it could not be resolved.  complete is False if the deadline cut the run short.
+        pending counts the requests sent less than timeout seconds before the deadline that had no reply yet, so they
+        should not be counted as lost.  Older requests without a reply are lost whether or not the run was complete.
+    """
+    if count < 1:
+        raise ValueError("Please specify a count of at least 1")
+
+    results = {}
+    addresses = {}
+    for host in hosts:
+        if deadlineExpired():
+            # Resolving a long list of names can use up the budget on its own, the rest are reported as not probed
+            results[host] = {"sent": 0, "rtts": [], "pending": 0}
+            continue
+        try:
+            addresses[host] = socket.gethostbyname(host)
+            results[host] = {"sent": 0, "rtts": [], "pending": 0}
+        except OSError as badnews:
+            results[host] = {"error": f"unable to resolve {host} because {badnews}"}
+    targets = list(addresses)
+
+    (sock, raw) = openICMPSocket()
+    with sock:
+        sock.setblocking(False)
+        # Datagram sockets have their identifier replaced by the kernel, so it only matters for raw sockets
+        identifier = os.getpid() & 0xFFFF
+        payload = b"cichecker-ping".ljust(16, b"\x00")
+        # sequence number -> (host, send time) for requests still waiting on a reply
+        pending = {}
+        sequence = 0
+        rounds_sent = 0
+        next_send = time.perf_counter()
+        deadline = None
+        complete = True
+
+        while True:
+            now = time.perf_counter()
+            if deadlineExpired():
+                # Requests younger than timeout might yet have been answered, so they are not counted as lost
+                for (host, sent_at) in pending.values():
+                    if now - sent_at < timeout:
+                        results[host]["pending"] += 1
+                complete = False
+                break
+
+            if rounds_sent < count and now >= next_send:
+                for host in targets:
+                    sequence = (sequence + 1) & 0xFFFF
+                    header = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+                    checksum = icmpChecksum(header + payload)
+                    packet = struct.pack("!BBHHH", ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+                    try:
+                        sock.sendto(packet, (addresses[host], 0))
+                        pending[sequence] = (host, time.perf_counter())
+                    except OSError as badnews:
+                        logger.debug(f"Unable to send echo request to {host} because {badnews}")
+                    results[host]["sent"] += 1
+                rounds_sent += 1
+                next_send = now + interval
+                if rounds_sent == count:
+                    deadline = time.perf_counter() + timeout
+                continue
+
+            if deadline is not None and (now >= deadline or len(pending) == 0):
+                break
+
+            wait_until = deadline if deadline is not None else next_send
+            (readable, _, _) = select.select([sock], [], [], max(0.0, capTimeout(wait_until - now)))
+            if not readable:
+                continue
+            # Drain everything that has arrived
+            while True:
+                try:
+                    (data, (source, _)) = sock.recvfrom(2048)
+                except BlockingIOError:
+                    break
+                received = time.perf_counter()
+                if len(data) > 0 and data[0] >> 4 == 4:
+                    # Raw sockets, and datagram sockets on macOS, include the IPv4 header.  An echo reply starts with type 0,
+                    # so a version nibble of 4 means there is a header to skip.
+                    data = data[(data[0] & 0x0F) * 4:]
+                if len(data) < 8:
+                    continue
+                (icmp_type, _, _, reply_id, reply_sequence) = struct.unpack("!BBHHH", data[:8])
+                if icmp_type != ICMP_ECHO_REPLY or (raw and reply_id != identifier):
+                    continue
+                if reply_sequence not in pending:
+                    continue
+                (host, sent_at) = pending[reply_sequence]
+                if addresses[host] != source:
+                    continue
+                del pending[reply_sequence]
+                results[host]["rtts"].append((received - sent_at) * 1000)
+
+    return (results, complete)
 
-def ping(host):
+def pingTest(
+        hosts:List[str],
+        count:int = 3,
+        timeout:float = 1.0,
+        warn_loss:float = 0.0,
+        crit_loss:float = 100.0
+) -> CheckResponse:
     """
-    NOT IMPLEMENTED
-    Returns True if host (str) responds to a ping request.
+    This check will ping one or more hosts at once and report round trip times and packet loss.
     Remember that a host may not respond to a ping (ICMP) request even if the host name is valid.
+
+    Parameters
+    ----------
+    hosts:List[str]
+        Host or list of hosts (or IPv4 addresses) to ping
+    count:int
+        Number of echo requests sent to each host
+    timeout:float
+        How long in seconds to wait for replies after the last request is sent.  If you make it too long you may hang you Nagios checks.
+        If the deadline (--deadline) comes first the check stops and reports the hosts it finished.
+    warn_loss:float
+        Packet loss percentage above which a host is WARNING
+    crit_loss:float
+        Packet loss percentage at or above which a host is CRITICAL
+
+    Returns
+    -------
+    CheckResponse
+        A check response object
     """
+    response = CheckResponse(name="pingTest")
+    if isinstance(hosts, str):
+        hosts = [hosts]
+
+    try:
+        (results, complete) = pingHosts(hosts, count=int(count), timeout=float(timeout))
+    except Exception as badnews:
+        logger.error("Check failed to run", exc_info=1)
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Unable to ping {', '.join(hosts)} because {badnews}"
+        return response
 
-    # Option for the number of packets as a function of
-    param = '-n' if platform.system().lower()=='windows' else '-c'
+    codes = []
+    messages = []
+    for host in hosts:
+        result = results[host]
+        if "error" in result:
+            codes.append(NCPAPluginReturnCodes.UNKNOWN)
+            messages.append(result["error"])
+            continue
+        if result["sent"] == 0:
+            messages.append(f"{host}: not probed before the deadline")
+            continue
+        # Only requests that were answered or have had the full timeout count towards loss
+        counted = result["sent"] - result["pending"]
+        if counted == 0:
+            messages.append(f"{host}: no replies due before the deadline")
+            continue
 
-    # Building the command. Ex: "ping -c 1 google.com"
-    command = ['ping', param, '1', host]
+        # Perfdata labels need to be unique when more than one host is checked
+        label_prefix = "" if len(hosts) == 1 else f"{host} "
+        rtts = result["rtts"]
+        loss = round(100.0 * (counted - len(rtts)) / counted, 1)
+        if loss >= crit_loss:
+            codes.append(NCPAPluginReturnCodes.CRITICAL)
+        elif loss > warn_loss:
+            codes.append(NCPAPluginReturnCodes.WARNING)
+        else:
+            codes.append(NCPAPluginReturnCodes.OK)
 
-    return subprocess.call(command) == 0   
\ No newline at end of file
+        if len(rtts) > 0:
+            rtt_min = round(min(rtts), 2)
+            rtt_avg = round(sum(rtts) / len(rtts), 2)
+            rtt_max = round(max(rtts), 2)
+            messages.append(f"{host}: {loss}% loss, rtt min/avg/max = {rtt_min}/{rtt_avg}/{rtt_max} ms")
+            response.performance_data.append(PerformanceData(label=f"{label_prefix}rtt_min", value=rtt_min, unit_of_measure="ms"))
+            response.performance_data.append(PerformanceData(label=f"{label_prefix}rtt_avg", value=rtt_avg, unit_of_measure="ms"))
+            response.performance_data.append(PerformanceData(label=f"{label_prefix}rtt_max", value=rtt_max, unit_of_measure="ms"))
+        else:
+            messages.append(f"{host}: {loss}% loss, no replies")
+        response.performance_data.append(
+            PerformanceData(
+                label=f"{label_prefix}loss",
+                value=loss,
+                unit_of_measure="%",
+                warn_threshold=warn_loss,
+                crit_threshold=crit_loss,
+                min_value=0,
+                max_value=100
+            )
+        )
+
+    if not complete:
+        # Problems already found still count, otherwise we cannot say everything is fine
+        probed = len([h for h in hosts if results[h].get("sent", 0) > 0])
+        response.return_code = worstReturnCode(codes + [NCPAPluginReturnCodes.UNKNOWN])
+        response.message = f"Deadline reached after probing {probed} of {len(hosts)} hosts"
+        response.verbose = "\n".join(messages)
+        response.performance_data.append(PerformanceData(label="endpointsProbed", value=probed, unit_of_measure=""))
+        return response
+
+    response.return_code = worstReturnCode(codes)
+    if len(hosts) == 1:
+        response.message = messages[0]
+    else:
+        failed = len([c for c in codes if c != NCPAPluginReturnCodes.OK])
+        response.message = f"{len(hosts) - failed} of {len(hosts)} hosts responding without loss"
+        response.verbose = "\n".join(messages)
+
+    return response
@@ -0,0 +1,374 @@
+import hashlib
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+from pydantic import BaseModel, Field
+
+from cichecker.messages import (
+    CheckResponse,
+    NCPAPluginReturnCodes,
+    PerformanceData,
+    truthiness
+)
+from cichecker.deadline import deadlineExpired
+from cichecker.cilogger import logger
+# logger.setLevel("DEBUG")
+
+# This module does not import winreg itself so the snapshot and diff logic can run (and be tested) on any platform.
+# Only WinregBackend needs Windows.
+
+class RegistryBackend(ABC):
+    """
+    Interface for something that can enumerate a registry subtree.  Subclass and implement keyExists() and walk().
+    """
+    @abstractmethod
+    def keyExists(self, full_key:str) -> bool:
+        """
+        Returns True if full_key exists
+        """
+
+    @abstractmethod
+    def walk(self, full_key:str, skipped:List[str] = None) -> Iterator[Tuple[str, str, object]]:
+        """
+        Enumerates every value under full_key, including all subkeys, in a single pass.
+        Subkeys that cannot be opened (deleted during the walk, or access denied) are left out along with everything below them.
+
+        Parameters
+        ----------
+        full_key:str
+            A registry key string from hive to key.  For example: HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies
+        skipped:List[str]
+            If given, the key path of each subkey that could not be opened is appended to it
+
+        Returns
+        -------
+        Iterator[Tuple[str, str, object]]
+            (key path, value name, value data) for each value found
+
+        Raises
+        ------
+        FileNotFoundError
+            If full_key does not exist
+        """
+
+class WinregBackend(RegistryBackend):
+    """
+    Reads the live Windows registry.  Each key in the subtree is opened exactly once.
+    """
+    def __init__(self):
+        # Imported here so the module still loads on non-Windows machines
+        import winreg
+        from cichecker.checks.registry import getAcceptableHives, RegistryKeyParseError
+        self.winreg = winreg
+        self.hives = getAcceptableHives()
+        self.parse_error = RegistryKeyParseError
+
+    def splitKey(self, full_key:str) -> tuple:
+        """
+        Returns (hive name, hive constant, key below the hive) for a full key string
+        """
+        full_key_list = full_key.rstrip("\\").split("\\")
+        hive = full_key_list.pop(0)
+        hive_id = self.hives.get(hive, None)
+        if hive_id is None:
+            raise self.parse_error(f"Unknown hive {hive} specified.")
+        return (hive, hive_id, "\\".join(full_key_list))
+
+    def keyExists(self, full_key:str) -> bool:
+        (hive, hive_id, key) = self.splitKey(full_key)
+        try:
+            with self.winreg.OpenKeyEx(hive_id, key):
+                return True
+        except FileNotFoundError:
+            return False
+
+    def walk(self, full_key:str, skipped:List[str] = None) -> Iterator[Tuple[str, str, object]]:
+        (hive, hive_id, root) = self.splitKey(full_key)
+
+        to_visit = [root]
+        while len(to_visit) > 0:
+            key = to_visit.pop()
+            key_path = f"{hive}\\{key}" if key else hive
+            try:
+                key_handle = self.winreg.OpenKeyEx(hive_id, key)
+            except (FileNotFoundError, PermissionError) as badnews:
+                if key == root:
+                    raise
+                # Deleted since its parent was listed, or protected (common under HKLM)
+                logger.debug(f"Skipping {key_path} because {badnews}")
+                if skipped is not None:
+                    skipped.append(key_path)
+                continue
+            with key_handle:
+                (sub_key_count, value_count, last_mod) = self.winreg.QueryInfoKey(key_handle)
+                # The counts can shrink if values or subkeys are deleted while we enumerate, which ends with OSError
+                for i in range(value_count):
+                    try:
+                        (name, data, value_type) = self.winreg.EnumValue(key_handle, i)
+                    except OSError:
+                        break
+                    yield (key_path, name, data)
+                for i in range(sub_key_count):
+                    try:
+                        sub_key = self.winreg.EnumKey(key_handle, i)
+                    except OSError:
+                        break
+                    to_visit.append(f"{key}\\{sub_key}" if key else sub_key)
+
+class MemoryRegistryBackend(RegistryBackend):
+    """
+    An in-memory registry, used for testing the snapshot logic without Windows.
+
+    Parameters
+    ----------
+    keys:Dict[str, Dict[str, object]]
+        Full key paths mapped to their values.  For example: {"HKEY_LOCAL_MACHINE\\SOFTWARE\\App": {"Enabled": 1}}
+        Parent keys do not need to be listed.  Like the real registry, key paths are not case sensitive.
+    unreadable_keys:List[str]
+        Key paths to treat as access denied.  They and their subkeys are skipped by walk().
+    """
+    def __init__(self, keys:Dict[str, Dict[str, object]] = None, unreadable_keys:List[str] = None):
+        self.keys = keys if keys is not None else {}
+        self.unreadable_keys = unreadable_keys if unreadable_keys is not None else []
+
+    def _matches(self, full_key:str) -> List[str]:
+        root = full_key.rstrip("\\").lower()
+        return [k for k in sorted(self.keys) if k.lower() == root or k.lower().startswith(root + "\\")]
+
+    def keyExists(self, full_key:str) -> bool:
+        return len(self._matches(full_key)) > 0
+
+    def walk(self, full_key:str, skipped:List[str] = None) -> Iterator[Tuple[str, str, object]]:
+        matches = self._matches(full_key)
+        if len(matches) == 0:
+            raise FileNotFoundError(f"{full_key} not found")
+        unreadable = [k.lower() for k in self.unreadable_keys]
+        for key_path in matches:
+            blocked = [u for u in unreadable if key_path.lower() == u or key_path.lower().startswith(u + "\\")]
+            if len(blocked) > 0:
+                if skipped is not None and key_path.lower() in unreadable:
+                    skipped.append(key_path)
+                continue
+            for (name, data) in self.keys[key_path].items():
+                yield (key_path, name, data)
+
+class RegistryManifest(BaseModel):
+    """
+    A stored registry snapshot to compare later snapshots against
+
+    Parameters
+    ----------
+    root:str
+        The registry key the snapshot was taken from
+    hashed:bool
+        True if values holds SHA1 hashes of the data rather than the data itself
+    values:Dict[str, str]
+        Full value paths mapped to their stringified data (or hash)
+    complete:bool
+        False if the deadline stopped the snapshot part way through the subtree
+    skipped_keys:List[str]
+        Subkeys that could not be read, so their values are not in the snapshot
+    """
+    root:str = Field(description="The registry key the snapshot was taken from")
+    hashed:bool = Field(description="True if values are SHA1 hashes of the data", default=False)
+    values:Dict[str, str] = Field(description="Full value paths mapped to stringified data or hash", default={})
+    complete:bool = Field(description="False if the snapshot was stopped by the deadline", default=True)
+    skipped_keys:List[str] = Field(description="Subkeys that could not be read", default=[])
+
+    def save(self, filename:Path):
+        Path(filename).write_text(self.model_dump_json(indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, filename:Path) -> "RegistryManifest":
+        return cls.model_validate_json(Path(filename).read_text(encoding="utf-8"))
+
+def takeSnapshot(
+        full_key:str,
+        backend:RegistryBackend,
+        generate_hash:bool = False
+) -> RegistryManifest:
+    """
+    Enumerates every value below full_key into a manifest.  Stops early, with manifest.complete set to False, if the deadline passes.
+    Subkeys that cannot be read are listed in manifest.skipped_keys.
+
+    Raises FileNotFoundError if full_key itself does not exist.
+
+    Parameters
+    ----------
+    full_key:str
+        A registry key string from hive to key.  For example: HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies
+    backend:RegistryBackend
+        Where to read the registry from
+    generate_hash:bool
+        Set to True to store a hash of each value rather than the value itself
+
+    Returns
+    -------
+    RegistryManifest
+        The snapshot
+    """
+    if not backend.keyExists(full_key):
+        raise FileNotFoundError(f"{full_key} does not exist")
+    manifest = RegistryManifest(root=full_key, hashed=generate_hash)
+    for (key_path, name, data) in backend.walk(full_key, skipped=manifest.skipped_keys):
+        if deadlineExpired():
+            manifest.complete = False
+            break
+        # Same stringification as getRegistryValue2 so single value checks and snapshots agree
+        value = str(data)
+        if generate_hash:
+            value = hashlib.sha1(value.encode()).hexdigest()
+        manifest.values[f"{key_path}\\{name}"] = value
+    logger.debug(f"Snapshot of {full_key} has {len(manifest.values)} values")
+    return manifest
+
+def diffSnapshots(
+        baseline:RegistryManifest,
+        current:RegistryManifest
+) -> Tuple[list, list, list]:
+    """
+    Compares two snapshots of the same key
+
+    Returns
+    -------
+    Tuple[list, list, list]
+        (changed, added, removed) value paths, each sorted
+    """
+    baseline_paths = set(baseline.values)
+    current_paths = set(current.values)
+    changed = sorted(p for p in baseline_paths & current_paths if baseline.values[p] != current.values[p])
+    added = sorted(current_paths - baseline_paths)
+    removed = sorted(baseline_paths - current_paths)
+    return (changed, added, removed)
+
+def registrySnapshotGenerate(
+    full_key:str,
+    manifest_file:Path,
+    generate_hash:bool = False,
+    backend:RegistryBackend = None
+) -> CheckResponse:
+    """
+    Takes a snapshot of a registry subtree and saves it as the baseline manifest for registrySnapshotCheck
+
+    Parameters
+    ----------
+    full_key:str
+        A registry key string from hive to key.  For example: HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies
+    manifest_file:Path
+        Where to save the manifest
+    generate_hash:bool
+        Set to True to store hashes of values instead of the values
+    backend:RegistryBackend
+        Where to read the registry from.  Defaults to the live Windows registry.
+
+    Returns
+    -------
+    CheckResponse
+        The response object
+    """
+    response = CheckResponse(name="Registry snapshot")
+    try:
+        if backend is None:
+            backend = WinregBackend()
+        manifest = takeSnapshot(full_key, backend, generate_hash=generate_hash)
+        if not manifest.complete:
+            # A partial baseline would report everything after the cut as added, so it is not saved
+            response.return_code = NCPAPluginReturnCodes.UNKNOWN
+            response.message = f"Deadline reached after reading {len(manifest.values)} values under {full_key}, baseline not saved"
+            response.performance_data.append(PerformanceData(label="values", value=len(manifest.values), unit_of_measure=""))
+            return response
+        manifest.save(manifest_file)
+        response.return_code = NCPAPluginReturnCodes.OK
+        response.message = f"Saved {len(manifest.values)} values under {full_key} to {manifest_file}"
+        if len(manifest.skipped_keys) > 0:
+            response.message += f", {len(manifest.skipped_keys)} keys could not be read"
+            response.verbose = "\n".join(f"skipped: {k}" for k in manifest.skipped_keys)
+        response.performance_data.append(
+            PerformanceData(label="values", value=len(manifest.values), unit_of_measure="")
+        )
+    except FileNotFoundError:
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"{full_key} does not exist"
+    except Exception as badnews:
+        logger.error("Check failed to run", exc_info=1)
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Unable to snapshot registry key because {badnews}"
+
+    return response
+
+def registrySnapshotCheck(
+    manifest_file:Path,
+    backend:RegistryBackend = None
+) -> CheckResponse:
+    """
+    Compares the registry against a baseline manifest made by registrySnapshotGenerate and reports every difference at once
+
+    Parameters
+    ----------
+    manifest_file:Path
+        The baseline manifest
+    backend:RegistryBackend
+        Where to read the registry from.  Defaults to the live Windows registry.
+
+    Returns
+    -------
+    CheckResponse
+        The response object.  verbose lists each changed, added and removed value.
+    """
+    response = CheckResponse(name="Registry snapshot check")
+    try:
+        if backend is None:
+            backend = WinregBackend()
+        baseline = RegistryManifest.load(manifest_file)
+        if backend.keyExists(baseline.root):
+            current = takeSnapshot(baseline.root, backend, generate_hash=baseline.hashed)
+        else:
+            # The whole subtree is gone, so every baseline value has been removed
+            current = RegistryManifest(root=baseline.root, hashed=baseline.hashed)
+        (changed, added, removed) = diffSnapshots(baseline, current)
+        if not current.complete:
+            # Values the walk did not reach yet are not known to be removed
+            removed = []
+        # Values under keys we could not read this time are unknown, not removed
+        newly_skipped = [k for k in current.skipped_keys if k not in baseline.skipped_keys]
+        removed = [p for p in removed if not any(p.lower().startswith(k.lower() + "\\") for k in current.skipped_keys)]
+
+        differences = len(changed) + len(added) + len(removed)
+        if not current.complete:
+            response.return_code = NCPAPluginReturnCodes.CRITICAL if differences > 0 else NCPAPluginReturnCodes.UNKNOWN
+            response.message = f"Deadline reached after checking {len(current.values)} of {len(baseline.values)} values under {baseline.root}: {len(changed)} changed, {len(added)} added so far"
+            verbose = [f"changed: {p}" for p in changed]
+            verbose += [f"added: {p}" for p in added]
+            response.verbose = "\n".join(verbose) or None
+            response.performance_data.append(PerformanceData(label="valuesChecked", value=len(current.values), unit_of_measure=""))
+        elif differences == 0 and len(newly_skipped) > 0:
+            response.return_code = NCPAPluginReturnCodes.WARNING
+            response.message = f"No differences found under {baseline.root}, but {len(newly_skipped)} keys could not be read"
+            response.verbose = "\n".join(f"skipped: {k}" for k in newly_skipped)
+        elif differences == 0:
+            response.return_code = NCPAPluginReturnCodes.OK
+            response.message = f"All {len(baseline.values)} values under {baseline.root} match the baseline"
+        else:
+            response.return_code = NCPAPluginReturnCodes.CRITICAL
+            response.message = f"{baseline.root} differs from the baseline: {len(changed)} changed, {len(added)} added, {len(removed)} removed"
+            verbose = [f"changed: {p}" for p in changed]
+            verbose += [f"added: {p}" for p in added]
+            verbose += [f"removed: {p}" for p in removed]
+            verbose += [f"skipped: {k}" for k in newly_skipped]
+            response.verbose = "\n".join(verbose)
+
+        response.performance_data.append(truthiness(differences == 0 and current.complete))
+        response.performance_data.append(PerformanceData(label="changed", value=len(changed), unit_of_measure=""))
+        response.performance_data.append(PerformanceData(label="added", value=len(added), unit_of_measure=""))
+        response.performance_data.append(PerformanceData(label="removed", value=len(removed), unit_of_measure=""))
+        response.performance_data.append(PerformanceData(label="keysSkipped", value=len(current.skipped_keys), unit_of_measure=""))
+    except FileNotFoundError as badnews:
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"{badnews.filename or badnews} does not exist"
+    except Exception as badnews:
+        logger.error("Check failed to run", exc_info=1)
+        response.return_code = NCPAPluginReturnCodes.UNKNOWN
+        response.message = f"Unable to check registry snapshot because {badnews}"
+
+    return response
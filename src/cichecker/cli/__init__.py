@@ -2,6 +2,8 @@
 #
 # SPDX-License-Identifier: MIT
 import typer
+from typer import Option
+from typing_extensions import Annotated
 import sys
 
 from cichecker.__about__ import __version__
@@ -10,9 +12,16 @@ from cichecker.cli.subcommands import (
     network
 )
 from cichecker.cilogger import logger
+from cichecker.deadline import setDeadline
 
 ci_app = typer.Typer(help=f"Version: {__version__}")
 
+@ci_app.callback()
+def main(
+    deadline:Annotated[float, Option(help="Seconds the check may run for.  Set this below the NCPA plugin timeout to get a partial result instead of no result.")] = None
+):
+    setDeadline(deadline)
+
 ci_app.add_typer(network.app, name="network", help="Commands to test network connectivity", no_args_is_help=True)
 ci_app.add_typer(file_checks.app, name="file", help="Commands to test critical files", no_args_is_help=True)
 
@@ -43,3 +43,13 @@ def hash(
     print(result.toNCPAMessage())
     sys.exit(result.return_code.value)
 
+@app.command()
+def policy(
+    policy_file:Annotated[Path, Argument(help="TOML file of [[rule]] tables giving paths or globs and their expected attributes")],
+):
+    """
+    Check many files and directories against expected existence, type, mode, owner, group, size and age in one go
+    """
+    result = cifile.policyTest(policy_file)
+    print(result.toNCPAMessage())
+    sys.exit(result.return_code.value)
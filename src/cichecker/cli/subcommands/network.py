@@ -2,8 +2,10 @@ import typer
 from typer import Argument, Option
 from typing_extensions import Annotated
 import sys
+from typing import List
+from pathlib import Path
 
-from cichecker.checks import network
+from cichecker.checks import network, cihttp
 
 app = typer.Typer()
 
@@ -19,12 +21,14 @@ def connect(
     dest_host:Annotated[str, Argument(help="The destination host you want to check connection to")], 
     dest_port:Annotated[int, Argument(help="The destination port you want to check conection to")], 
     protocol:Annotated[str, Option(help="Protocol to test with (TCP or UDP)", callback=protocol_callback)] = "TCP",
-    timeout:Annotated[float, Option(help="The timeout before this check will fail.")] = 5.0
+    timeout:Annotated[float, Option(help="The timeout before this check will fail.")] = 5.0,
+    history_dir:Annotated[Path, Option(help="Directory to keep rolling connect time history in.  Enables WARNING on slow connections")] = None,
+    warn_factor:Annotated[float, Option(help="WARN when connect time is more than this many times the rolling p95.  Needs --history-dir")] = 3.0
 ):
     """
     Check to make sure the host can connect to the provided endpoint
     """
-    result = network.connectTest(dest_host, dest_port, protocol, timeout)
+    result = network.connectTest(dest_host, dest_port, protocol, timeout, history_dir=history_dir, warn_factor=warn_factor)
     print(result.toNCPAMessage())
     #return result.return_code.value
     sys.exit(result.return_code.value)
@@ -44,5 +48,37 @@ def block(
     print(result.toNCPAMessage())
     sys.exit(result.return_code.value)
 
+@app.command()
+def ping(
+    hosts:Annotated[List[str], Argument(help="One or more hosts or IPv4 addresses to ping")],
+    count:Annotated[int, Option(help="Number of echo requests to send to each host", min=1)] = 3,
+    timeout:Annotated[float, Option(help="How long to wait for replies after the last request is sent.")] = 1.0,
+    warn_loss:Annotated[float, Option(help="Packet loss percentage above which a host is WARNING")] = 0.0,
+    crit_loss:Annotated[float, Option(help="Packet loss percentage at or above which a host is CRITICAL")] = 100.0
+):
+    """
+    Check to make sure hosts respond to ping (ICMP echo).  All hosts are pinged at once.
+    """
+    result = network.pingTest(hosts, count, timeout, warn_loss, crit_loss)
+    print(result.toNCPAMessage())
+    sys.exit(result.return_code.value)
+
+@app.command()
+def http(
+    urls:Annotated[List[str], Argument(help="One or more URLs to request")],
+    expected_status:Annotated[int, Option(help="The HTTP status code the endpoints should return")] = 200,
+    expected_content:Annotated[str, Option(help="Text that must appear in the response body")] = None,
+    etag:Annotated[str, Option(help="Make a conditional request with this ETag.  OK if unchanged (304), CRITICAL if changed")] = None,
+    if_modified_since:Annotated[str, Option(help="Make a conditional request with this HTTP date.  OK if unchanged (304), CRITICAL if changed")] = None,
+    timeout:Annotated[float, Option(help="The timeout before this check will fail.")] = 5.0,
+    insecure:Annotated[bool, Option("--insecure", help="Set this flag to skip TLS certificate verification", is_flag=True, flag_value=True)] = False,
+):
+    """
+    Check to make sure HTTP(S) endpoints respond as expected, or have not changed
+    """
+    result = cihttp.httpTest(urls, expected_status, expected_content, etag, if_modified_since, timeout, verify_tls=not insecure)
+    print(result.toNCPAMessage())
+    sys.exit(result.return_code.value)
+
 if __name__ == "__main__":
     app()
\ No newline at end of file
@@ -2,8 +2,9 @@ import typer
 from typer import Argument, Option
 from typing_extensions import Annotated
 import sys
+from pathlib import Path
 
-from cichecker.checks import registry
+from cichecker.checks import registry, registry_snapshot
 
 app = typer.Typer()
 
@@ -33,4 +34,26 @@ def retrieve(
      print(result.toNCPAMessage())
      sys.exit(result.return_code.value)
 
+@app.command()
+def snapshot(
+    full_registry_key:Annotated[str, Argument(help="A registry key string from hive to key.  For example: HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies")],
+    manifest_file:Annotated[Path, Argument(help="Where to save the baseline manifest")],
+    hash:Annotated[bool, Option("--hash", help="Set this flag to store hashes of values, as opposed to values themselves", is_flag=True, flag_value=True)] = False,
+):
+     """
+     Saves every value under a registry key as a baseline manifest for 'registry compare'
+     """
+     result = registry_snapshot.registrySnapshotGenerate(full_registry_key, manifest_file, generate_hash=hash)
+     print(result.toNCPAMessage())
+     sys.exit(result.return_code.value)
 
+@app.command()
+def compare(
+    manifest_file:Annotated[Path, Argument(help="A baseline manifest made with 'registry snapshot'")],
+):
+     """
+     Compares the registry against a baseline manifest and reports every changed, added or removed value
+     """
+     result = registry_snapshot.registrySnapshotCheck(manifest_file)
+     print(result.toNCPAMessage())
+     sys.exit(result.return_code.value)
@@ -0,0 +1,45 @@
+import time
+
+# A single process-wide deadline, set once by the CLI (--deadline) and checked cooperatively by every check.
+# Checks stop when it passes and report what they finished instead of being killed by NCPA with no output.
+_expires = None
+
+class DeadlineExceeded(Exception):
+    pass
+
+def setDeadline(seconds:float = None):
+    """
+    Sets the deadline to seconds from now.  None removes the deadline.
+    """
+    global _expires
+    _expires = None if seconds is None else time.perf_counter() + float(seconds)
+
+def remainingTime() -> float:
+    """
+    Returns the seconds left before the deadline (never negative), or None if there is no deadline
+    """
+    if _expires is None:
+        return None
+    return max(0.0, _expires - time.perf_counter())
+
+def deadlineExpired() -> bool:
+    """
+    Returns True if there is a deadline and it has passed
+    """
+    return _expires is not None and time.perf_counter() >= _expires
+
+def checkDeadline():
+    """
+    Raises DeadlineExceeded if the deadline has passed.  Call this inside long loops.
+    """
+    if deadlineExpired():
+        raise DeadlineExceeded("Deadline reached")
+
+def capTimeout(timeout:float) -> float:
+    """
+    Returns timeout, shortened if needed so it ends no later than the deadline
+    """
+    remaining = remainingTime()
+    if remaining is None:
+        return timeout
+    return min(float(timeout), remaining)
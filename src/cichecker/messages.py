@@ -56,6 +56,23 @@ def truthiness(value:bool) -> PerformanceData:
     )
     return toreturn
 
+def worstReturnCode(codes:List[NCPAPluginReturnCodes]) -> NCPAPluginReturnCodes:
+    """
+    Returns the most severe of the given return codes, used when one check covers several targets.
+    Severity order is OK < UNKNOWN < WARNING < CRITICAL.  An empty list is OK.
+    """
+    severity = [
+        NCPAPluginReturnCodes.OK,
+        NCPAPluginReturnCodes.UNKNOWN,
+        NCPAPluginReturnCodes.WARNING,
+        NCPAPluginReturnCodes.CRITICAL
+    ]
+    worst = NCPAPluginReturnCodes.OK
+    for code in codes:
+        if severity.index(code) > severity.index(worst):
+            worst = code
+    return worst
+
 def datetime_utc():
     # Adapter to allow for a default timestamp
     return datetime.datetime.now(datetime.UTC)
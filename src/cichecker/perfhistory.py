@@ -0,0 +1,195 @@
+import mmap
+import os
+import re
+import struct
+from pathlib import Path
+from typing import List
+
+from cichecker.messages import PerformanceData
+from cichecker.cilogger import logger
+
+class HistoryFileError(Exception):
+    pass
+
+def percentile(values:List[float], pct:float) -> float:
+    """
+    Returns the pct percentile (0-100) of values using linear interpolation between the closest ranks
+
+    Parameters
+    ----------
+    values:List[float]
+        The samples, in any order.  Must not be empty.
+    pct:float
+        The percentile wanted, 0 to 100
+
+    Returns
+    -------
+    float
+        The percentile value
+    """
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+class RingBuffer:
+    """
+    A fixed-size ring buffer of float samples kept in a memory-mapped file, so each plugin run only touches the pages it needs.
+    Once the buffer is full the oldest sample is overwritten.
+
+    The file is a small header (magic, capacity, count, next write position) followed by capacity doubles.
+
+    Parameters
+    ----------
+    path:Path
+        The file to keep the samples in.  Created if it does not exist.
+    capacity:int
+        Number of samples to keep.  Only used when the file is created, an existing file keeps its own capacity.
+    """
+    MAGIC = b"CIRB"
+    HEADER = struct.Struct("<4sIII")
+
+    def __init__(self, path:Path, capacity:int = 288):
+        self.path = Path(path)
+        if not self.path.exists():
+            if capacity < 1:
+                raise ValueError("Capacity must be at least 1")
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, capacity, 0, 0))
+                f.write(b"\x00" * (capacity * 8))
+
+        self._file = self.path.open("r+b")
+        self._map = None
+        self._samples = None
+        try:
+            # Check the size first, a truncated file cannot be mapped or hold a header
+            if os.fstat(self._file.fileno()).st_size < self.HEADER.size:
+                raise HistoryFileError(f"{self.path} is too short to be a history file")
+            self._map = mmap.mmap(self._file.fileno(), 0)
+            (magic, self.capacity, _, _) = self.HEADER.unpack_from(self._map, 0)
+            if magic != self.MAGIC or len(self._map) != self.HEADER.size + self.capacity * 8:
+                raise HistoryFileError(f"{self.path} is not a history file")
+            # View the sample area as an array of doubles so reads and writes go straight to the mapped pages
+            self._samples = memoryview(self._map)[self.HEADER.size:].cast("d")
+        except HistoryFileError:
+            self.close()
+            raise
+        except (ValueError, OSError, struct.error) as badnews:
+            self.close()
+            raise HistoryFileError(f"{self.path} is not a usable history file because {badnews}") from badnews
+
+    def _counters(self) -> tuple:
+        (_, _, count, head) = self.HEADER.unpack_from(self._map, 0)
+        return (count, head)
+
+    def __len__(self):
+        return self._counters()[0]
+
+    def append(self, value:float):
+        """
+        Adds a sample, overwriting the oldest one if the buffer is full
+        """
+        (count, head) = self._counters()
+        self._samples[head] = float(value)
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, self.capacity, min(count + 1, self.capacity), (head + 1) % self.capacity)
+
+    def values(self) -> List[float]:
+        """
+        Returns the stored samples, oldest first
+        """
+        (count, head) = self._counters()
+        if count < self.capacity:
+            return self._samples[:count].tolist()
+        return self._samples[head:].tolist() + self._samples[:head].tolist()
+
+    def close(self):
+        if self._samples is not None:
+            self._samples.release()
+            self._samples = None
+        if self._map is not None and not self._map.closed:
+            self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def historyPath(history_dir:Path, key:str) -> Path:
+    """
+    Returns the history file for a given check key, for example 'connectTest_example.com_443_TCP_connectTime'
+    """
+    safe_key = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+    return Path(history_dir) / f"{safe_key}.hist"
+
+def checkAgainstHistory(
+        perf:PerformanceData,
+        key:str,
+        history_dir:Path,
+        warn_factor:float = 3.0,
+        min_samples:int = 10,
+        capacity:int = 288,
+        min_threshold:float = 1.0,
+        sample:float = None
+) -> tuple:
+    """
+    Compares a new measurement with the rolling history for this check, then records it.
+
+    If there are at least min_samples earlier samples, perf.warn_threshold is set to warn_factor times the rolling p95,
+    but never below min_threshold so very fast, steady measurements do not warn on tiny changes.
+    The new sample is recorded after the comparison so an outlier does not raise its own threshold.
+    A history file that is damaged is replaced with a new, empty one.
+
+    Parameters
+    ----------
+    perf:PerformanceData
+        The new measurement.  Its warn_threshold is updated in place.
+    key:str
+        Identifies this check and target, used to pick the history file
+    history_dir:Path
+        Directory holding the history files
+    warn_factor:float
+        How many times the rolling p95 a measurement can be before it is out of specification
+    min_samples:int
+        Number of samples needed before thresholds are applied
+    capacity:int
+        Number of samples kept per check when a new history file is created
+    min_threshold:float
+        The lowest warn threshold that will be set, in the unit of perf
+    sample:float
+        The unrounded measurement to compare and record.  Defaults to perf.value
+
+    Returns
+    -------
+    tuple
+        (List of p50/p95 PerformanceData, True if the measurement is above the threshold)
+    """
+    extra_perf = []
+    exceeded = False
+    if sample is None:
+        sample = perf.value
+    path = historyPath(history_dir, key)
+    try:
+        history = RingBuffer(path, capacity)
+    except HistoryFileError as badnews:
+        logger.warning(f"{badnews}, starting a new history")
+        path.unlink()
+        history = RingBuffer(path, capacity)
+
+    with history:
+        samples = history.values()
+        if len(samples) >= min_samples:
+            p50 = percentile(samples, 50)
+            p95 = percentile(samples, 95)
+            perf.warn_threshold = max(round(p95 * warn_factor, 1), min_threshold)
+            exceeded = sample > perf.warn_threshold
+            extra_perf.append(PerformanceData(label=f"{perf.label}_p50", value=round(p50, 1), unit_of_measure=perf.unit_of_measure))
+            extra_perf.append(PerformanceData(label=f"{perf.label}_p95", value=round(p95, 1), unit_of_measure=perf.unit_of_measure))
+        else:
+            logger.debug(f"{len(samples)} samples in history for {key}, need {min_samples} before applying thresholds")
+        history.append(sample)
+
+    return (extra_perf, exceeded)
@@ -0,0 +1,135 @@
+# SPDX-FileCopyrightText: 2024-present richmr <richmr@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+import socket
+import time
+
+import pytest
+
+from cichecker.messages import NCPAPluginReturnCodes
+from cichecker.cilogger import logger
+
+from cichecker.deadline import (
+    setDeadline,
+    remainingTime,
+    deadlineExpired,
+    capTimeout
+)
+from cichecker.checks.cifile import integrityTest, policyTest, FilePolicyRule
+from cichecker.checks import network
+from cichecker.checks.network import connectTest, pingTest
+from cichecker.checks.registry_snapshot import (
+    MemoryRegistryBackend,
+    registrySnapshotGenerate,
+    registrySnapshotCheck
+)
+
+logger.setLevel("DEBUG")
+
+@pytest.fixture(autouse=True)
+def clear_deadline():
+    yield
+    setDeadline(None)
+
+def test_deadline_helpers():
+    assert remainingTime() is None
+    assert not deadlineExpired()
+    assert capTimeout(5.0) == 5.0
+
+    setDeadline(10)
+    assert 9 < remainingTime() <= 10
+    assert capTimeout(5.0) == 5.0
+    assert capTimeout(60.0) <= 10
+
+    setDeadline(0)
+    assert deadlineExpired()
+    assert capTimeout(5.0) == 0.0
+
+def test_integrityTest_deadline(tmp_path):
+    for i in range(5):
+        (tmp_path / f"f{i}").write_bytes(b"data")
+    setDeadline(0)
+    response = integrityTest(tmp_path, "hash", recurse=True)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message.startswith("Deadline reached")
+
+def test_policyTest_deadline(tmp_path):
+    setDeadline(0)
+    response = policyTest([FilePolicyRule(paths=[str(tmp_path)], type="dir")])
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    perf = {p.label: p.value for p in response.performance_data}
+    assert perf["pathsChecked"] == 0
+
+def test_connectTest_deadline():
+    setDeadline(0)
+    response = connectTest("127.0.0.1", 1)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def test_pingTest_deadline():
+    # The deadline passes while waiting between rounds, so only the first round is counted
+    setDeadline(0.1)
+    start = time.perf_counter()
+    response = pingTest(["127.0.0.1", "127.0.0.2"], count=5)
+    assert time.perf_counter() - start < 0.5
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message == "Deadline reached after probing 2 of 2 hosts"
+
+class DroppingSocket(socket.socket):
+    """
+    An ICMP socket whose echo requests never arrive, like a host that does not answer
+    """
+    def sendto(self, data, address):
+        return len(data)
+
+def test_pingTest_deadline_counts_timed_out_requests(monkeypatch):
+    real_openICMPSocket = network.openICMPSocket
+    def fake_openICMPSocket():
+        (sock, raw) = real_openICMPSocket()
+        return (DroppingSocket(fileno=sock.detach()), raw)
+    monkeypatch.setattr(network, "openICMPSocket", fake_openICMPSocket)
+
+    # By the deadline the first two rounds have had their full timeout, so they are lost.  Only the last round is still waiting.
+    setDeadline(0.6)
+    response = pingTest("127.0.0.9", count=3, timeout=0.3)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert response.message == "Deadline reached after probing 1 of 1 hosts"
+    assert "127.0.0.9: 100.0% loss" in response.verbose
+
+def test_pingTest_deadline_while_resolving(monkeypatch):
+    def slow_gethostbyname(host):
+        time.sleep(0.1)
+        return "127.0.0.1"
+    monkeypatch.setattr(socket, "gethostbyname", slow_gethostbyname)
+
+    setDeadline(0.25)
+    start = time.perf_counter()
+    hosts = [f"host{i}.example" for i in range(10)]
+    response = pingTest(hosts)
+    assert time.perf_counter() - start < 0.6
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message == "Deadline reached after probing 0 of 10 hosts"
+    assert "host9.example: not probed before the deadline" in response.verbose
+
+def test_connectTest_deadline_while_resolving(monkeypatch):
+    real_getaddrinfo = socket.getaddrinfo
+    def slow_getaddrinfo(*args):
+        time.sleep(0.5)
+        return real_getaddrinfo(*args)
+    monkeypatch.setattr(socket, "getaddrinfo", slow_getaddrinfo)
+
+    setDeadline(0.3)
+    response = connectTest("127.0.0.1", 1)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message.startswith("Deadline reached")
+
+def test_registrySnapshot_deadline(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    keys = {"HKEY_LOCAL_MACHINE\\SOFTWARE\\App": {"A": 1, "B": 2}}
+    registrySnapshotGenerate("HKEY_LOCAL_MACHINE\\SOFTWARE\\App", manifest_file, backend=MemoryRegistryBackend(keys))
+
+    setDeadline(0)
+    response = registrySnapshotCheck(manifest_file, backend=MemoryRegistryBackend(keys))
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    response = registrySnapshotGenerate("HKEY_LOCAL_MACHINE\\SOFTWARE\\App", tmp_path / "other.json", backend=MemoryRegistryBackend(keys))
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert not (tmp_path / "other.json").exists()
@@ -0,0 +1,176 @@
+# SPDX-FileCopyrightText: 2024-present richmr <richmr@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+import os
+import time
+
+import pytest
+
+from cichecker.messages import NCPAPluginReturnCodes
+from cichecker.cilogger import logger
+
+from pydantic import ValidationError
+
+from cichecker.checks import cifile
+from cichecker.checks.cifile import (
+    FilePolicyRule,
+    checkFilePolicy,
+    policyTest
+)
+
+logger.setLevel("DEBUG")
+
+@pytest.fixture
+def config_tree(tmp_path):
+    conf = tmp_path / "conf"
+    conf.mkdir()
+    for name in ["a.conf", "b.conf", "c.conf"]:
+        (conf / name).write_text("setting=on\n")
+        os.chmod(conf / name, 0o640)
+    (conf / ".hidden.conf").write_text("")
+    (conf / "sub").mkdir()
+    (conf / "sub" / "d.conf").write_text("setting=off\n")
+    os.chmod(conf / "sub" / "d.conf", 0o640)
+    return conf
+
+def test_policy_ok(config_tree):
+    rules = [
+        FilePolicyRule(paths=[f"{config_tree}/*.conf", f"{config_tree}/sub/d.conf"], type="file", mode="0640", min_size=1, max_size=100, max_age=3600),
+        FilePolicyRule(paths=[str(config_tree / "sub")], type="dir"),
+        FilePolicyRule(paths=[str(config_tree / "secrets.txt")], exists=False),
+    ]
+    response = policyTest(rules)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    assert response.message == "All 6 paths match the policy"
+
+def test_policy_violations(config_tree):
+    os.chmod(config_tree / "b.conf", 0o666)
+    (config_tree / "c.conf").write_text("")
+    old = time.time() - 7200
+    os.utime(config_tree / "a.conf", (old, old))
+    rules = [
+        FilePolicyRule(paths=[f"{config_tree}/*.conf"], type="file", mode="0640", min_size=1, max_age=3600),
+        FilePolicyRule(paths=[str(config_tree / "missing.conf"), str(config_tree / "sub")], type="file"),
+        FilePolicyRule(paths=[f"{config_tree}/**/d.conf"], exists=False),
+    ]
+    (checked, violations, complete) = checkFilePolicy(rules)
+    assert complete
+    kinds = sorted(kind for (_, kind, _) in violations)
+    assert kinds == ["age", "missing", "mode", "size", "type", "unexpected"]
+    assert checked == 6
+
+    response = policyTest(rules)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert response.message == "6 policy violations in 6 paths checked"
+    perf = {p.label: p.value for p in response.performance_data}
+    assert perf["violations"] == 6
+    assert perf["mode"] == 1
+    assert perf["owner"] == 0
+
+def test_policy_owner(config_tree):
+    uid = str(os.getuid())
+    rules = [FilePolicyRule(paths=[f"{config_tree}/*.conf"], owner=uid, group=str(os.getgid()))]
+    assert checkFilePolicy(rules)[1] == []
+    rules = [FilePolicyRule(paths=[f"{config_tree}/*.conf"], owner=str(os.getuid() + 1))]
+    assert len(checkFilePolicy(rules)[1]) == 3
+
+def test_policy_file(config_tree, tmp_path):
+    policy_file = tmp_path / "policy.toml"
+    policy_file.write_text(f"""
+[[rule]]
+paths = ["{config_tree}/*.conf"]
+type = "file"
+mode = "0640"
+
+[[rule]]
+paths = ["{config_tree}/nothing/*.conf"]
+""")
+    response = policyTest(policy_file)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert "missing:" in response.verbose
+
+def test_policy_bad_file(tmp_path):
+    response = policyTest(tmp_path / "missing.toml")
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def test_policy_rejects_unknown_keys(tmp_path):
+    with pytest.raises(ValidationError):
+        FilePolicyRule(paths=["/etc/passwd"], onwer="root", mdoe="0600")
+
+    policy_file = tmp_path / "policy.toml"
+    policy_file.write_text("""
+[[rule]]
+paths = ["/etc/passwd"]
+mdoe = "0600"
+""")
+    response = policyTest(policy_file)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def test_policy_root():
+    (checked, violations, complete) = checkFilePolicy([FilePolicyRule(paths=["/"], type="dir")])
+    assert checked == 1
+    assert violations == []
+
+def test_policy_case_insensitive(config_tree, monkeypatch):
+    # Act as Windows does, where names differing only in case are the same file
+    monkeypatch.setattr(os.path, "normcase", lambda path: path.lower())
+    rules = [FilePolicyRule(paths=[f"{config_tree}/A.CONF", f"{config_tree}/*.CONF", f"{config_tree}/*/D.Conf"], type="file", mode="0640")]
+    (checked, violations, complete) = checkFilePolicy(rules)
+    assert violations == []
+    assert checked == 5
+
+def test_policy_unreadable_directory(config_tree, monkeypatch):
+    real_scandir = os.scandir
+    def scandir(path):
+        if os.path.basename(path) == "sub":
+            raise PermissionError(13, "Permission denied", path)
+        return real_scandir(path)
+    monkeypatch.setattr(cifile.os, "scandir", scandir)
+
+    rules = [FilePolicyRule(paths=[f"{config_tree}/*.conf", f"{config_tree}/sub/d.conf", f"{config_tree}/sub/*.conf"], mode="0640")]
+    (checked, violations, complete) = checkFilePolicy(rules)
+    # The readable directory is still checked, the unreadable one is reported per path
+    assert checked == 5
+    assert [kind for (_, kind, _) in violations] == ["permission", "permission"]
+
+def test_policy_file_removed_mid_check(config_tree, monkeypatch):
+    real_entries = cifile.DirectoryListing.entries
+    def entries(self, directory):
+        listed = real_entries(self, directory)
+        # Remove a file after it has been listed but before it is stat'ed
+        if directory == str(config_tree):
+            (config_tree / "b.conf").unlink(missing_ok=True)
+        return listed
+    monkeypatch.setattr(cifile.DirectoryListing, "entries", entries)
+
+    (checked, violations, complete) = checkFilePolicy([FilePolicyRule(paths=[f"{config_tree}/*.conf"], mode="0640")])
+    assert checked == 3
+    assert violations == [(str(config_tree / "b.conf"), "missing", "was removed while being checked")]
+
+def test_policy_recursive_glob(config_tree):
+    (config_tree / "sub" / "deeper").mkdir()
+    (config_tree / "sub" / "deeper" / "e.conf").write_text("x")
+    rules = [FilePolicyRule(paths=[f"{config_tree}/**/*.conf"], type="file")]
+    (checked, violations, complete) = checkFilePolicy(rules)
+    # Hidden files are skipped, like glob
+    assert checked == 5
+    assert complete
+
+    rules = [FilePolicyRule(paths=[f"{config_tree}/sub/**"])]
+    assert checkFilePolicy(rules)[0] == 3
+
+def test_policy_recursive_glob_deadline(config_tree, monkeypatch):
+    from cichecker.deadline import setDeadline
+    real_entries = cifile.DirectoryListing.entries
+    def entries(self, directory):
+        # The deadline passes part way through walking the tree
+        if directory.endswith("sub"):
+            setDeadline(0)
+        return real_entries(self, directory)
+    monkeypatch.setattr(cifile.DirectoryListing, "entries", entries)
+    try:
+        (checked, violations, complete) = checkFilePolicy([FilePolicyRule(paths=[f"{config_tree}/**/*.conf"], type="file")])
+    finally:
+        setDeadline(None)
+    assert not complete
+    assert violations == []
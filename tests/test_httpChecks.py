@@ -0,0 +1,180 @@
+# SPDX-FileCopyrightText: 2024-present richmr <richmr@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cichecker.messages import NCPAPluginReturnCodes
+from cichecker.cilogger import logger
+
+from cichecker.deadline import setDeadline
+from cichecker.checks.cihttp import httpTest
+
+logger.setLevel("DEBUG")
+
+CONFIG_BODY = b"setting=on\n"
+CONFIG_ETAG = '"v1"'
+CONFIG_LAST_MODIFIED = "Mon, 10 Jun 2024 12:00:00 GMT"
+
+class StandInHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 so the client can keep the connection alive
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self.server.connections.add(self.client_address)
+        if self.path == "/slow":
+            time.sleep(1.0)
+            self.send_body(200, b"finally")
+        elif self.path == "/trickle":
+            # Headers straight away, then the body a few bytes at a time so no single read times out
+            body = b"status: healthy" * 4
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                for i in range(0, len(body), 4):
+                    self.wfile.write(body[i:i+4])
+                    self.wfile.flush()
+                    time.sleep(0.1)
+            except (BrokenPipeError, ConnectionResetError):
+                # The client gave up at its deadline
+                pass
+        elif self.path in ("/stall", "/short"):
+            # Promise more body than is sent, then either stall or hang up
+            self.send_response(200)
+            self.send_header("Content-Length", "100")
+            self.end_headers()
+            self.wfile.write(b"status: ")
+            self.wfile.flush()
+            if self.path == "/stall":
+                time.sleep(1.0)
+            self.close_connection = True
+        elif self.path == "/health":
+            self.send_body(200, b"status: healthy")
+        elif self.path == "/config":
+            if self.headers.get("If-None-Match") == CONFIG_ETAG or self.headers.get("If-Modified-Since") == CONFIG_LAST_MODIFIED:
+                self.send_body(304, b"")
+            else:
+                self.send_body(200, CONFIG_BODY, {"ETag": CONFIG_ETAG, "Last-Modified": CONFIG_LAST_MODIFIED})
+        else:
+            self.send_body(404, b"not found")
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    httpd.connections = set()
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+def base_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def test_httpTest_ok(server):
+    response = httpTest(f"{base_url(server)}/health", expected_content="healthy")
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    labels = [p.label for p in response.performance_data]
+    assert "ttfb" in labels
+    assert "totalTime" in labels
+
+def test_httpTest_wrong_status(server):
+    response = httpTest(f"{base_url(server)}/missing")
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+
+def test_httpTest_wrong_content(server):
+    response = httpTest(f"{base_url(server)}/health", expected_content="degraded")
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+
+def test_httpTest_etag_unchanged(server):
+    response = httpTest(f"{base_url(server)}/config", etag=CONFIG_ETAG)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    assert "not changed" in response.message
+
+def test_httpTest_etag_changed(server):
+    response = httpTest(f"{base_url(server)}/config", etag='"v0"')
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert CONFIG_ETAG in response.message
+
+def test_httpTest_if_modified_since_unchanged(server):
+    response = httpTest(f"{base_url(server)}/config", if_modified_since=CONFIG_LAST_MODIFIED)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+
+def test_httpTest_many_urls_reuse_connection(server):
+    server.connections.clear()
+    urls = [f"{base_url(server)}/health"] * 5
+    response = httpTest(urls)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    assert response.message == "5 of 5 URLs OK"
+    # All five requests should have gone over one kept-alive connection
+    assert len(server.connections) == 1
+
+def test_httpTest_unreachable():
+    # Port 9 (discard) should not be listening on localhost
+    response = httpTest("http://127.0.0.1:9/", timeout=1.0)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+
+def test_httpTest_deadline(server):
+    setDeadline(0.3)
+    try:
+        start = time.perf_counter()
+        response = httpTest([f"{base_url(server)}/health", f"{base_url(server)}/slow", f"{base_url(server)}/health"])
+        assert time.perf_counter() - start < 0.9
+    finally:
+        setDeadline(None)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message == "Deadline reached after probing 1 of 3 URLs"
+    perf = {p.label: p.value for p in response.performance_data}
+    assert perf["endpointsProbed"] == 1
+
+def test_httpTest_trickle_ok(server):
+    response = httpTest(f"{base_url(server)}/trickle", expected_content="healthy")
+    assert response.return_code == NCPAPluginReturnCodes.OK
+
+@pytest.mark.parametrize("expected_content", [None, "healthy"])
+def test_httpTest_deadline_while_reading_body(server, expected_content):
+    # The whole body takes about 1.5 seconds, the deadline must stop the read part way through
+    setDeadline(0.3)
+    try:
+        start = time.perf_counter()
+        response = httpTest(f"{base_url(server)}/trickle", expected_content=expected_content)
+        assert time.perf_counter() - start < 0.9
+    finally:
+        setDeadline(None)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message == "Deadline reached after probing 0 of 1 URLs"
+
+def test_httpTest_stalled_body(server):
+    response = httpTest(f"{base_url(server)}/stall", expected_content="healthy", timeout=0.3)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert response.message.startswith("Not able to reach")
+
+def test_httpTest_short_body(server):
+    response = httpTest(f"{base_url(server)}/short")
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert response.message.startswith("Not able to reach")
+
+def test_httpTest_deadline_stalled_body(server):
+    # The read times out only because the deadline shortened the timeout, so this is a partial result
+    setDeadline(0.3)
+    try:
+        response = httpTest(f"{base_url(server)}/stall", timeout=5.0)
+    finally:
+        setDeadline(None)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+    assert response.message == "Deadline reached after probing 0 of 1 URLs"
@@ -1,9 +1,18 @@
+import errno
+import socket
+import time
+
+import pytest
+
 from cichecker.messages import NCPAPluginReturnCodes
 from cichecker.cilogger import logger
 
+from cichecker.checks import network
 from cichecker.checks.network import (
     connectTest,
-    blockTest
+    blockTest,
+    pingTest,
+    happyEyeballsConnect
 )
 
 logger.setLevel("DEBUG")
@@ -37,3 +46,181 @@ def test_blockTest_closed():
 
     response = blockTest(dest_host, dest_port)
     assert response.return_code == NCPAPluginReturnCodes.OK
+
+def test_pingTest_localhost():
+    response = pingTest("127.0.0.1", count=2)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    labels = [p.label for p in response.performance_data]
+    assert labels == ["rtt_min", "rtt_avg", "rtt_max", "loss"]
+
+def test_pingTest_many_hosts():
+    hosts = ["127.0.0.1", "127.0.0.2", "localhost"]
+    response = pingTest(hosts, count=2)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    assert response.message == "3 of 3 hosts responding without loss"
+
+class HeaderSocket(socket.socket):
+    """
+    A datagram ICMP socket that delivers the IPv4 header with each reply, as macOS does
+    """
+    def recvfrom(self, bufsize):
+        (data, address) = super().recvfrom(bufsize)
+        return (b"\x45" + b"\x00" * 19 + data, address)
+
+def test_pingTest_datagram_with_ip_header(monkeypatch):
+    real_openICMPSocket = network.openICMPSocket
+    def fake_openICMPSocket():
+        (sock, raw) = real_openICMPSocket()
+        if raw:
+            # Raw sockets already include the header
+            return (sock, False)
+        return (HeaderSocket(fileno=sock.detach()), False)
+    monkeypatch.setattr(network, "openICMPSocket", fake_openICMPSocket)
+    response = pingTest("127.0.0.1", count=2)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+
+def test_pingTest_bad_count():
+    response = pingTest("127.0.0.1", count=0)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def test_pingTest_unresolvable():
+    response = pingTest(["127.0.0.1", "no-such-host.invalid"], count=1)
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def listen(family, address):
+    listener = socket.socket(family, socket.SOCK_STREAM)
+    listener.bind((address, 0))
+    listener.listen(5)
+    return listener
+
+def test_connectTest_local_closed_returns_early():
+    # Grab a free port, then close it so nothing is listening there
+    listener = listen(socket.AF_INET, "127.0.0.1")
+    port = listener.getsockname()[1]
+    listener.close()
+    start = time.perf_counter()
+    response = connectTest("127.0.0.1", port, timeout=5.0)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert time.perf_counter() - start < 1.0
+
+def test_connectTest_ipv6():
+    listener = listen(socket.AF_INET6, "::1")
+    try:
+        response = connectTest("::1", listener.getsockname()[1])
+        assert response.return_code == NCPAPluginReturnCodes.OK
+        assert "IPv6" in response.message
+    finally:
+        listener.close()
+
+def test_happyEyeballsConnect_falls_back_to_ipv4(monkeypatch):
+    # Dual-stack name where only IPv4 is listening, IPv6 is tried first and refused
+    listener = listen(socket.AF_INET, "127.0.0.1")
+    port = listener.getsockname()[1]
+    def fake_getaddrinfo(host, port, family, sock_type):
+        return [
+            (socket.AF_INET6, sock_type, 6, "", ("::1", port, 0, 0)),
+            (socket.AF_INET, sock_type, 6, "", ("127.0.0.1", port)),
+        ]
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo)
+    try:
+        start = time.perf_counter()
+        (sock, family) = happyEyeballsConnect("dualstack.test", port, timeout=5.0, attempt_delay=2.0)
+        sock.close()
+        assert family == socket.AF_INET
+        # The refused IPv6 attempt should start IPv4 straight away, not after attempt_delay
+        assert time.perf_counter() - start < 1.0
+    finally:
+        listener.close()
+
+def test_happyEyeballsConnect_ipv6_disabled(monkeypatch):
+    # localhost still resolves to ::1 on hosts with IPv6 disabled, where opening an IPv6 socket fails
+    listener = listen(socket.AF_INET, "127.0.0.1")
+    port = listener.getsockname()[1]
+    def fake_getaddrinfo(host, port, family, sock_type):
+        return [
+            (socket.AF_INET6, sock_type, 6, "", ("::1", port, 0, 0)),
+            (socket.AF_INET, sock_type, 6, "", ("127.0.0.1", port)),
+        ]
+    real_socket = socket.socket
+    def fake_socket(family=socket.AF_INET, *args, **kwargs):
+        if family == socket.AF_INET6:
+            raise OSError(errno.EAFNOSUPPORT, "Address family not supported by protocol")
+        return real_socket(family, *args, **kwargs)
+    monkeypatch.setattr(socket, "getaddrinfo", fake_getaddrinfo)
+    monkeypatch.setattr(socket, "socket", fake_socket)
+    try:
+        response = connectTest("localhost", port)
+        assert response.return_code == NCPAPluginReturnCodes.OK
+        assert "IPv4" in response.message
+    finally:
+        listener.close()
+
+def test_happyEyeballsConnect_closes_pending_on_error(monkeypatch):
+    # The connect never completes, so the attempt is still pending when select fails
+    opened = []
+    real_socket = socket.socket
+    monkeypatch.setattr(real_socket, "connect_ex", lambda self, address: errno.EINPROGRESS)
+    def tracking_socket(*args, **kwargs):
+        sock = real_socket(*args, **kwargs)
+        opened.append(sock)
+        return sock
+    def failing_select(*args):
+        raise RuntimeError("select failed")
+    monkeypatch.setattr(socket, "socket", tracking_socket)
+    monkeypatch.setattr(network.select, "select", failing_select)
+    with pytest.raises(RuntimeError):
+        happyEyeballsConnect("127.0.0.1", 80, timeout=5.0)
+    assert len(opened) == 1
+    assert all(s.fileno() == -1 for s in opened)
+
+def winsock_errors(monkeypatch, connect_result=None):
+    """
+    Makes sockets report errors the way Windows does: WSAEWOULDBLOCK for a pending connect, WSAECONNREFUSED when refused.
+    connect_result, if set, is returned by connect_ex instead of trying to connect.
+    """
+    to_windows = {errno.EINPROGRESS: 10035, errno.ECONNREFUSED: 10061}
+    real_connect_ex = socket.socket.connect_ex
+    real_getsockopt = socket.socket.getsockopt
+
+    def connect_ex(self, address):
+        if connect_result is not None:
+            return connect_result
+        result = real_connect_ex(self, address)
+        return to_windows.get(result, result)
+
+    def getsockopt(self, *args):
+        result = real_getsockopt(self, *args)
+        if args[:2] == (socket.SOL_SOCKET, socket.SO_ERROR):
+            return to_windows.get(result, result)
+        return result
+
+    monkeypatch.setattr(socket.socket, "connect_ex", connect_ex)
+    monkeypatch.setattr(socket.socket, "getsockopt", getsockopt)
+
+def test_connectTest_windows_open(monkeypatch):
+    winsock_errors(monkeypatch)
+    listener = listen(socket.AF_INET, "127.0.0.1")
+    try:
+        response = connectTest("127.0.0.1", listener.getsockname()[1])
+        assert response.return_code == NCPAPluginReturnCodes.OK
+    finally:
+        listener.close()
+
+def test_connectTest_windows_refused(monkeypatch):
+    listener = listen(socket.AF_INET, "127.0.0.1")
+    port = listener.getsockname()[1]
+    listener.close()
+    winsock_errors(monkeypatch)
+    start = time.perf_counter()
+    response = connectTest("127.0.0.1", port, timeout=5.0)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert time.perf_counter() - start < 1.0
+
+def test_connectTest_windows_unreachable(monkeypatch):
+    # WSAEHOSTUNREACH
+    winsock_errors(monkeypatch, connect_result=10065)
+    response = connectTest("127.0.0.1", 1, timeout=5.0)
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert "unreachable" in response.message
+    response = blockTest("127.0.0.1", 1, timeout=5.0)
+    assert response.return_code == NCPAPluginReturnCodes.OK
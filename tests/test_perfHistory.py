@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2024-present richmr <richmr@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+import socket
+
+import pytest
+
+from cichecker.messages import NCPAPluginReturnCodes, PerformanceData
+from cichecker.cilogger import logger
+
+from cichecker.perfhistory import (
+    RingBuffer,
+    HistoryFileError,
+    percentile,
+    historyPath,
+    checkAgainstHistory
+)
+from cichecker.checks.network import connectTest
+
+logger.setLevel("DEBUG")
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 50) == pytest.approx(50.5)
+    assert percentile(values, 95) == pytest.approx(95.05)
+    assert percentile([7.0], 95) == 7.0
+
+def test_ringbuffer_wraps_and_persists(tmp_path):
+    path = tmp_path / "check.hist"
+    with RingBuffer(path, capacity=3) as history:
+        for value in [1, 2, 3, 4, 5]:
+            history.append(value)
+        assert history.values() == [3.0, 4.0, 5.0]
+
+    # Capacity comes from the existing file, not the argument
+    with RingBuffer(path, capacity=100) as history:
+        assert history.capacity == 3
+        assert len(history) == 3
+        history.append(6)
+        assert history.values() == [4.0, 5.0, 6.0]
+
+def test_ringbuffer_rejects_other_files(tmp_path):
+    path = tmp_path / "not_history.hist"
+    path.write_bytes(b"this is not a ring buffer")
+    with pytest.raises(HistoryFileError):
+        RingBuffer(path)
+
+def test_ringbuffer_rejects_truncated_files(tmp_path):
+    for contents in [b"", b"CIRB"]:
+        path = tmp_path / "truncated.hist"
+        path.write_bytes(contents)
+        with pytest.raises(HistoryFileError):
+            RingBuffer(path)
+
+def test_checkAgainstHistory_replaces_bad_file(tmp_path):
+    historyPath(tmp_path, "key").write_bytes(b"CIRB")
+    (extra, exceeded) = checkAgainstHistory(PerformanceData(label="t", value=10.0, unit_of_measure="ms"), "key", tmp_path)
+    assert not exceeded
+    with RingBuffer(historyPath(tmp_path, "key")) as history:
+        assert history.values() == [10.0]
+
+def test_checkAgainstHistory_min_threshold(tmp_path):
+    # Very fast connections round to 0.0, a tiny change must not warn
+    for _ in range(10):
+        checkAgainstHistory(PerformanceData(label="t", value=0.0, unit_of_measure="ms"), "key", tmp_path, sample=0.02)
+    perf = PerformanceData(label="t", value=0.1, unit_of_measure="ms")
+    (extra, exceeded) = checkAgainstHistory(perf, "key", tmp_path, sample=0.08)
+    assert not exceeded
+    assert perf.warn_threshold == 1.0
+    with RingBuffer(historyPath(tmp_path, "key")) as history:
+        # Unrounded samples are stored
+        assert history.values()[-1] == 0.08
+
+def test_checkAgainstHistory(tmp_path):
+    for _ in range(10):
+        (extra, exceeded) = checkAgainstHistory(PerformanceData(label="t", value=10.0, unit_of_measure="ms"), "key", tmp_path)
+        assert extra == []
+        assert not exceeded
+
+    # Ten samples now in history, thresholds apply
+    perf = PerformanceData(label="t", value=25.0, unit_of_measure="ms")
+    (extra, exceeded) = checkAgainstHistory(perf, "key", tmp_path)
+    assert not exceeded
+    assert perf.warn_threshold == 30.0
+    assert [p.label for p in extra] == ["t_p50", "t_p95"]
+
+    perf = PerformanceData(label="t", value=500.0, unit_of_measure="ms")
+    (extra, exceeded) = checkAgainstHistory(perf, "key", tmp_path)
+    assert exceeded
+
+def test_connectTest_history(tmp_path):
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(50)
+    port = listener.getsockname()[1]
+    try:
+        for _ in range(12):
+            response = connectTest("127.0.0.1", port, history_dir=tmp_path)
+            assert response.return_code == NCPAPluginReturnCodes.OK
+        labels = [p.label for p in response.performance_data]
+        assert "connectTime_p95" in labels
+    finally:
+        listener.close()
@@ -0,0 +1,132 @@
+# SPDX-FileCopyrightText: 2024-present richmr <richmr@users.noreply.github.com>
+#
+# SPDX-License-Identifier: MIT
+import pytest
+
+from cichecker.messages import NCPAPluginReturnCodes
+from cichecker.cilogger import logger
+
+from cichecker.checks.registry_snapshot import (
+    MemoryRegistryBackend,
+    RegistryBackend,
+    RegistryManifest,
+    takeSnapshot,
+    diffSnapshots,
+    registrySnapshotGenerate,
+    registrySnapshotCheck
+)
+
+logger.setLevel("DEBUG")
+
+ROOT = "HKEY_LOCAL_MACHINE\\SOFTWARE\\Policies"
+
+def make_registry():
+    return {
+        f"{ROOT}\\App": {"Enabled": 1, "Mode": "strict"},
+        f"{ROOT}\\App\\Logging": {"Level": "info"},
+        f"{ROOT}\\Other": {"Flag": 0},
+        "HKEY_LOCAL_MACHINE\\SOFTWARE\\Unrelated": {"Ignored": 1},
+    }
+
+def test_takeSnapshot():
+    manifest = takeSnapshot(ROOT, MemoryRegistryBackend(make_registry()))
+    assert manifest.values == {
+        f"{ROOT}\\App\\Enabled": "1",
+        f"{ROOT}\\App\\Mode": "strict",
+        f"{ROOT}\\App\\Logging\\Level": "info",
+        f"{ROOT}\\Other\\Flag": "0",
+    }
+
+def test_takeSnapshot_hashed():
+    manifest = takeSnapshot(ROOT, MemoryRegistryBackend(make_registry()), generate_hash=True)
+    assert manifest.hashed
+    assert manifest.values[f"{ROOT}\\App\\Mode"] == "41eaab877ca3a0e3aa14f5a4b7981f590e3c2bd6"
+
+def test_diffSnapshots():
+    baseline = takeSnapshot(ROOT, MemoryRegistryBackend(make_registry()))
+    keys = make_registry()
+    keys[f"{ROOT}\\App"]["Mode"] = "permissive"
+    keys[f"{ROOT}\\App"]["New"] = "yes"
+    del keys[f"{ROOT}\\Other"]
+    current = takeSnapshot(ROOT, MemoryRegistryBackend(keys))
+
+    (changed, added, removed) = diffSnapshots(baseline, current)
+    assert changed == [f"{ROOT}\\App\\Mode"]
+    assert added == [f"{ROOT}\\App\\New"]
+    assert removed == [f"{ROOT}\\Other\\Flag"]
+
+def test_registrySnapshotCheck_ok(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    backend = MemoryRegistryBackend(make_registry())
+    response = registrySnapshotGenerate(ROOT, manifest_file, backend=backend)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+    assert RegistryManifest.load(manifest_file).root == ROOT
+
+    response = registrySnapshotCheck(manifest_file, backend=backend)
+    assert response.return_code == NCPAPluginReturnCodes.OK
+
+def test_registrySnapshotCheck_changed(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    registrySnapshotGenerate(ROOT, manifest_file, generate_hash=True, backend=MemoryRegistryBackend(make_registry()))
+
+    keys = make_registry()
+    keys[f"{ROOT}\\App\\Logging"]["Level"] = "debug"
+    keys[f"{ROOT}\\Other"]["Added"] = 1
+    response = registrySnapshotCheck(manifest_file, backend=MemoryRegistryBackend(keys))
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert "1 changed, 1 added, 0 removed" in response.message
+    assert f"changed: {ROOT}\\App\\Logging\\Level" in response.verbose
+
+def test_registrySnapshotCheck_root_removed(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    registrySnapshotGenerate(ROOT, manifest_file, backend=MemoryRegistryBackend(make_registry()))
+
+    response = registrySnapshotCheck(manifest_file, backend=MemoryRegistryBackend({}))
+    assert response.return_code == NCPAPluginReturnCodes.CRITICAL
+    assert "4 removed" in response.message
+
+def test_registrySnapshotCheck_missing_manifest(tmp_path):
+    response = registrySnapshotCheck(tmp_path / "missing.json", backend=MemoryRegistryBackend(make_registry()))
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+class VanishingKeyBackend(MemoryRegistryBackend):
+    """
+    A backend whose walk fails part way through, as if a subkey was deleted between listing and opening it
+    """
+    def walk(self, full_key, skipped=None):
+        for (i, item) in enumerate(super().walk(full_key, skipped)):
+            if i == 2:
+                raise FileNotFoundError("subkey deleted mid-walk")
+            yield item
+
+def test_registrySnapshotCheck_error_mid_walk(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    registrySnapshotGenerate(ROOT, manifest_file, backend=MemoryRegistryBackend(make_registry()))
+
+    # The root still exists, so this must not be reported as every value removed
+    response = registrySnapshotCheck(manifest_file, backend=VanishingKeyBackend(make_registry()))
+    assert response.return_code == NCPAPluginReturnCodes.UNKNOWN
+
+def test_registrySnapshotCheck_unreadable_subkey(tmp_path):
+    manifest_file = tmp_path / "baseline.json"
+    registrySnapshotGenerate(ROOT, manifest_file, backend=MemoryRegistryBackend(make_registry()))
+
+    backend = MemoryRegistryBackend(make_registry(), unreadable_keys=[f"{ROOT}\\App"])
+    manifest = takeSnapshot(ROOT, backend)
+    assert manifest.skipped_keys == [f"{ROOT}\\App"]
+    assert list(manifest.values) == [f"{ROOT}\\Other\\Flag"]
+
+    response = registrySnapshotCheck(manifest_file, backend=backend)
+    assert response.return_code == NCPAPluginReturnCodes.WARNING
+    perf = {p.label: p.value for p in response.performance_data}
+    assert perf["removed"] == 0
+    assert perf["keysSkipped"] == 1
+
+def test_backend_missing_method():
+    class KeyExistsOnly(RegistryBackend):
+        def keyExists(self, full_key):
+            return True
+
+    # Caught when the backend is created, not part way through a check
+    with pytest.raises(TypeError):
+        KeyExistsOnly()